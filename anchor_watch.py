@@ -0,0 +1,364 @@
+"""
+Anchored-vessel and anchor-drag detection
+
+`collect_ais.filter_vessels` keeps only moving vessels, so this pipeline runs
+on every vessel in the collection regions instead. For each MMSI it holds a
+fixed-size ring buffer of recent fixes in flat `array` storage (one slot per
+vessel, no per-fix objects) together with running sums of the fixes, so the
+anchor circle (centroid and RMS spread) is updated in O(1) per fix no matter
+how many vessels are at anchor.
+
+LOGIC:
+1. A vessel that is slow (SOG <= STATIONARY_SOG) or reports navStat 1 (at
+   anchor) accumulates fixes in its ring buffer.
+2. Once MIN_FIXES fixes fit inside MAX_ANCHOR_SPREAD_M, the centroid is frozen
+   as the anchor position and the swing radius is set from the spread.
+3. While anchored, fixes up to DRAG_MAX_SOG are still treated as "at anchor"
+   (a dragging vessel moves at 1-3 knots). DRAG_CONFIRM_FIXES consecutive
+   fixes outside the swing radius raise one drag alert.
+4. A vessel whose last MIN_FIXES fixes all lie outside the circle and settle
+   within MAX_ANCHOR_SPREAD_M has re-anchored (typically after dragging):
+   the circle is re-seeded there and a later drag alerts again.
+5. Faster than DRAG_MAX_SOG means the vessel weighed anchor: the slot resets.
+
+State is kept between runs in ANCHOR_STATE_FILE, which must survive from one
+collection to the next (the collect-ais workflow caches it); without it no
+vessel is ever seen often enough to count as anchored. The file is a JSON
+header followed by the raw bytes of each array (no pickle, so a restored
+cache file is only ever parsed as data).
+"""
+
+import json
+import math
+import os
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+
+from detector_utils import fix_time
+
+ANCHOR_STATE_FILE = os.environ.get('ANCHOR_STATE_FILE', 'data/ais/anchor_state.bin')
+
+RING_SIZE = 16               # fixes kept per vessel
+STATIONARY_SOG = 0.5         # knots, same threshold filter_vessels uses
+DRAG_MAX_SOG = 3.0           # knots, above this an anchored vessel has departed
+MIN_FIXES = 3                # fixes needed before an anchor position is fixed
+MAX_ANCHOR_SPREAD_M = 300.0  # RMS spread above which the vessel is not at anchor
+MIN_SWING_M = 150.0          # smallest swing radius we ever assume
+SWING_FACTOR = 2.0           # swing radius = max(MIN_SWING_M, SWING_FACTOR * RMS spread)
+DRAG_CONFIRM_FIXES = 2       # consecutive fixes outside the swing radius
+MAX_GAP_S = 6 * 3600         # a longer silence restarts the vessel's history
+EXPIRE_S = 48 * 3600         # forget vessels not seen for this long
+
+NAV_STAT_AT_ANCHOR = 1
+STATE_MAGIC = b'ANCHORWATCH1\n'
+EARTH_RADIUS_M = 6371000.0
+_M_PER_DEG = math.pi * EARTH_RADIUS_M / 180.0
+
+
+class AnchorWatch:
+    """Array-backed per-MMSI ring buffers with incremental anchor-circle statistics"""
+
+    def __init__(self, ring_size=RING_SIZE):
+        self.ring_size = ring_size
+        self.slots = {}     # mmsi -> slot index
+        self.free = []      # released slot indices
+        self.n_slots = 0
+
+        # Per-fix storage: ring_size entries per slot, positions in metres
+        # relative to the slot's reference point
+        self.fix_x = array('d')
+        self.fix_y = array('d')
+
+        # Per-slot state
+        self.ref_lon = array('d')
+        self.ref_lat = array('d')
+        self.cos_lat = array('d')
+        self.head = array('l')
+        self.count = array('l')
+        self.last_t = array('d')
+        self.sum_x = array('d')
+        self.sum_y = array('d')
+        self.sum_xx = array('d')
+        self.sum_yy = array('d')
+        self.anchored = array('b')
+        self.anchor_x = array('d')
+        self.anchor_y = array('d')
+        self.swing_r = array('d')
+        self.outside = array('l')
+        self.alerted = array('b')
+
+    # Everything saved besides ring_size, slots, free and n_slots
+    _ARRAYS = ('fix_x', 'fix_y', 'ref_lon', 'ref_lat', 'cos_lat', 'head', 'count',
+               'last_t', 'sum_x', 'sum_y', 'sum_xx', 'sum_yy', 'anchored',
+               'anchor_x', 'anchor_y', 'swing_r', 'outside', 'alerted')
+
+    # -- slot management -------------------------------------------------
+
+    def _grow(self):
+        new = max(64, self.n_slots)
+        self.fix_x.extend(array('d', bytes(8 * new * self.ring_size)))
+        self.fix_y.extend(array('d', bytes(8 * new * self.ring_size)))
+        for arr in (self.ref_lon, self.ref_lat, self.cos_lat, self.last_t,
+                    self.sum_x, self.sum_y, self.sum_xx, self.sum_yy,
+                    self.anchor_x, self.anchor_y, self.swing_r):
+            arr.extend(array('d', bytes(8 * new)))
+        for arr in (self.head, self.count, self.outside):
+            arr.extend(array('l', [0]) * new)
+        for arr in (self.anchored, self.alerted):
+            arr.extend(array('b', bytes(new)))
+        self.free.extend(range(self.n_slots + new - 1, self.n_slots - 1, -1))
+        self.n_slots += new
+
+    def _slot(self, mmsi, lon, lat):
+        s = self.slots.get(mmsi)
+        if s is not None:
+            return s
+        if not self.free:
+            self._grow()
+        s = self.free.pop()
+        self.slots[mmsi] = s
+        self._reset(s, lon, lat)
+        self.last_t[s] = 0.0
+        return s
+
+    def _reset(self, s, lon, lat):
+        """Clear a slot's history and re-centre its local frame on lon/lat"""
+        self.ref_lon[s] = lon
+        self.ref_lat[s] = lat
+        self.cos_lat[s] = math.cos(math.radians(lat))
+        self.head[s] = 0
+        self.count[s] = 0
+        self.sum_x[s] = self.sum_y[s] = self.sum_xx[s] = self.sum_yy[s] = 0.0
+        self.anchored[s] = 0
+        self.outside[s] = 0
+        self.alerted[s] = 0
+
+    def release(self, mmsi):
+        s = self.slots.pop(mmsi, None)
+        if s is not None:
+            self.free.append(s)
+
+    # -- statistics --------------------------------------------------------
+
+    def _push(self, s, x, y):
+        """Append a fix to the slot's ring buffer, evicting the oldest when full"""
+        base = s * self.ring_size
+        n = self.count[s]
+        i = (self.head[s] + n) % self.ring_size
+        if n == self.ring_size:
+            old_x = self.fix_x[base + i]
+            old_y = self.fix_y[base + i]
+            self.sum_x[s] -= old_x
+            self.sum_y[s] -= old_y
+            self.sum_xx[s] -= old_x * old_x
+            self.sum_yy[s] -= old_y * old_y
+            self.head[s] = (self.head[s] + 1) % self.ring_size
+        else:
+            self.count[s] = n + 1
+        self.fix_x[base + i] = x
+        self.fix_y[base + i] = y
+        self.sum_x[s] += x
+        self.sum_y[s] += y
+        self.sum_xx[s] += x * x
+        self.sum_yy[s] += y * y
+
+    def _centroid_spread(self, s):
+        n = self.count[s]
+        mx = self.sum_x[s] / n
+        my = self.sum_y[s] / n
+        var = self.sum_xx[s] / n - mx * mx + self.sum_yy[s] / n - my * my
+        return mx, my, math.sqrt(max(var, 0.0))
+
+    def _recent(self, s, k):
+        """The slot's last k fixes, oldest first, in local metres"""
+        base = s * self.ring_size
+        n = self.count[s]
+        return [(self.fix_x[base + (self.head[s] + i) % self.ring_size],
+                 self.fix_y[base + (self.head[s] + i) % self.ring_size])
+                for i in range(n - k, n)]
+
+    def _anchor(self, s):
+        """Freeze the slot's current centroid as its anchor if the fixes have settled"""
+        mx, my, spread = self._centroid_spread(s)
+        if spread > MAX_ANCHOR_SPREAD_M:
+            return
+        self.anchored[s] = 1
+        self.anchor_x[s] = mx
+        self.anchor_y[s] = my
+        self.swing_r[s] = max(MIN_SWING_M, SWING_FACTOR * spread)
+        self.outside[s] = 0
+
+    def _reanchor(self, s):
+        """Re-seed the anchor circle on the last MIN_FIXES fixes if they have settled"""
+        recent = self._recent(s, MIN_FIXES)
+        mx = sum(x for x, _ in recent) / MIN_FIXES
+        my = sum(y for _, y in recent) / MIN_FIXES
+        spread = math.sqrt(sum((x - mx) ** 2 + (y - my) ** 2 for x, y in recent) / MIN_FIXES)
+        if spread > MAX_ANCHOR_SPREAD_M:
+            return False
+        points = [self._to_lonlat(s, x, y) for x, y in recent]
+        self._reset(s, *points[-1])
+        for lon, lat in points:
+            self._push(s, *self._to_local(s, lon, lat))
+        self._anchor(s)
+        return True
+
+    def _to_local(self, s, lon, lat):
+        return ((lon - self.ref_lon[s]) * _M_PER_DEG * self.cos_lat[s],
+                (lat - self.ref_lat[s]) * _M_PER_DEG)
+
+    def _to_lonlat(self, s, x, y):
+        return (self.ref_lon[s] + x / (_M_PER_DEG * self.cos_lat[s]),
+                self.ref_lat[s] + y / _M_PER_DEG)
+
+    # -- public API --------------------------------------------------------
+
+    def update(self, mmsi, lon, lat, sog, nav_stat, t):
+        """Feed one position fix (t in epoch seconds). Returns a drag alert dict or None."""
+        sog = sog or 0.0
+        s = self.slots.get(mmsi)
+        slow = sog <= STATIONARY_SOG or nav_stat == NAV_STAT_AT_ANCHOR
+
+        if s is None:
+            if not slow:
+                return None  # only spend a slot on vessels that might be anchoring
+            s = self._slot(mmsi, lon, lat)
+        elif t <= self.last_t[s]:
+            return None  # repeat of a fix we already have
+        elif t - self.last_t[s] > MAX_GAP_S:
+            self._reset(s, lon, lat)
+
+        self.last_t[s] = t
+
+        if self.anchored[s]:
+            if sog > DRAG_MAX_SOG:
+                self._reset(s, lon, lat)  # weighed anchor and left
+                return None
+            x, y = self._to_local(s, lon, lat)
+            dist = math.hypot(x - self.anchor_x[s], y - self.anchor_y[s])
+            self._push(s, x, y)
+            if dist <= self.swing_r[s]:
+                self.outside[s] = 0
+                return None
+            self.outside[s] += 1
+            if self.outside[s] >= MIN_FIXES and self._reanchor(s):
+                return None  # settled at a new spot: watch that one from now on
+            if self.outside[s] < DRAG_CONFIRM_FIXES or self.alerted[s]:
+                return None
+            self.alerted[s] = 1
+            anchor_lon, anchor_lat = self._to_lonlat(s, self.anchor_x[s], self.anchor_y[s])
+            return {
+                'mmsi': mmsi,
+                'time': datetime.fromtimestamp(t, timezone.utc).isoformat(),
+                'anchor_lon': round(anchor_lon, 6),
+                'anchor_lat': round(anchor_lat, 6),
+                'lon': lon,
+                'lat': lat,
+                'distance_m': round(dist, 1),
+                'swing_radius_m': round(self.swing_r[s], 1),
+                'sog': sog
+            }
+
+        if not slow:
+            self._reset(s, lon, lat)  # under way: nothing to accumulate
+            return None
+
+        x, y = self._to_local(s, lon, lat)
+        self._push(s, x, y)
+        if self.count[s] >= MIN_FIXES:
+            self._anchor(s)
+        return None
+
+    def expire(self, now, max_age=EXPIRE_S):
+        """Release slots of vessels not heard from for max_age seconds"""
+        stale = [m for m, s in self.slots.items() if now - self.last_t[s] > max_age]
+        for mmsi in stale:
+            self.release(mmsi)
+        return len(stale)
+
+    def anchored_count(self):
+        return sum(1 for s in self.slots.values() if self.anchored[s])
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, path=ANCHOR_STATE_FILE):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = {
+            'ring_size': self.ring_size,
+            'n_slots': self.n_slots,
+            'slots': list(self.slots.items()),
+            'free': self.free,
+            'arrays': [[name, getattr(self, name).typecode, len(getattr(self, name))]
+                       for name in self._ARRAYS]
+        }
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp, 'wb') as fh:
+            fh.write(STATE_MAGIC)
+            fh.write(json.dumps(header).encode('utf-8') + b'\n')
+            for name in self._ARRAYS:
+                fh.write(getattr(self, name).tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=ANCHOR_STATE_FILE):
+        watch = cls()
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            watch._restore(data)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'anchor_watch.py: could not load state ({e}), starting fresh')
+            watch = cls()
+        return watch
+
+    def _restore(self, data):
+        if not data.startswith(STATE_MAGIC):
+            raise ValueError('unrecognised state file format')
+        end = data.index(b'\n', len(STATE_MAGIC))
+        header = json.loads(data[len(STATE_MAGIC):end])
+        if header['ring_size'] != self.ring_size:
+            print('anchor_watch.py: ring size changed, starting with empty state')
+            return
+        offset = end + 1
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            arr = array(getattr(self, name).typecode)
+            if typecode != arr.typecode:
+                raise ValueError(f'{name} stored as {typecode!r}')
+            nbytes = length * arr.itemsize
+            arr.frombytes(data[offset:offset + nbytes])
+            if len(arr) != length:
+                raise ValueError(f'{name} is truncated')
+            offset += nbytes
+            arrays[name] = arr
+        if set(arrays) != set(self._ARRAYS):
+            raise ValueError('state file is missing arrays')
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        self.n_slots = header['n_slots']
+        self.slots = {mmsi: slot for mmsi, slot in header['slots']}
+        self.free = header['free']
+
+
+def process_snapshot(features, timestamp, state_file=ANCHOR_STATE_FILE):
+    """Run one snapshot of GeoJSON features through the detector. Returns (alerts, anchored count)."""
+    watch = AnchorWatch.load(state_file)
+    now = timestamp.timestamp()
+
+    alerts = []
+    for feature in features:
+        props = feature['properties']
+        coords = feature['geometry']['coordinates']
+        alert = watch.update(props.get('mmsi'), coords[0], coords[1],
+                             props.get('sog'), props.get('navStat'),
+                             fix_time(props, now))
+        if alert:
+            alerts.append(alert)
+
+    watch.expire(now)
+    watch.save(state_file)
+    return alerts, watch.anchored_count()
@@ -1,48 +1,154 @@
 #!/usr/bin/env python3
-"""Quick check: How many rows are actually in the database?"""
+"""Quick check: How big is the database and what does it hold?
 
+Reads planner estimates, relation sizes and the timestamp range through the
+vessel_db_stats() function (sql/migrations/005_db_stats.sql) and estimates
+distinct MMSIs from the HyperLogLog sketch the collector maintains, so the
+cost does not grow with the table. --exact adds a full count (table scan).
+
+The sketch only sees MMSIs ingested after it was deployed; run
+--seed-sketch once (also a table scan) to fold in every MMSI already stored.
+
+Results are cached in .dbstats_cache.json for --ttl seconds (default 60).
+
+Usage:
+  python check_database.py [--exact] [--ttl SECONDS] [--json]
+  python check_database.py --seed-sketch
+"""
+
+import argparse
+import json
 import os
+import time
+
+from mmsi_sketch import load_sketch, update_mmsi_sketch
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://baeebralrmgccruigyle.supabase.co')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 
-def main():
+CACHE_FILE = '.dbstats_cache.json'
+DEFAULT_TTL = int(os.environ.get('DBSTATS_TTL', '60'))
+
+
+def _format_bytes(n):
+    if n is None:
+        return 'unknown'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def read_cache(exact, ttl):
+    try:
+        with open(CACHE_FILE, 'r') as fh:
+            cached = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - cached.get('fetched_at', 0) > ttl:
+        return None
+    # An exact result also satisfies an estimate-only request
+    if exact and not cached.get('exact'):
+        return None
+    return cached
+
+
+def write_cache(stats):
+    tmp = CACHE_FILE + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(stats, fh)
+    os.replace(tmp, CACHE_FILE)
+
+
+def collect_stats(exact=False):
     from supabase import create_client
-    
-    print(f"Connecting to: {SUPABASE_URL}")
-    print(f"Using key: {SUPABASE_KEY[:20]}..." if SUPABASE_KEY else "NO KEY SET!")
-    
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+    stats = supabase.rpc('vessel_db_stats', {}).execute().data
+    # reltuples is -1 until the table has been analyzed once
+    if stats.get('estimated_rows') is not None and stats['estimated_rows'] < 0:
+        stats['estimated_rows'] = None
+
+    stats['estimated_unique_mmsi'] = load_sketch(supabase).estimate()
+
+    if exact:
+        stats.update(supabase.rpc('vessel_db_stats_exact', {}).execute().data)
+    stats['exact'] = exact
+    stats['fetched_at'] = time.time()
+    return stats
+
+
+def seed_sketch():
+    """Fold every stored MMSI into the sketch (safe to repeat)"""
+    from supabase import create_client
+
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    
-    # Count total rows
-    response = supabase.table('vessel_positions').select('*', count='exact').limit(1).execute()
-    total_count = response.count
-    
-    print(f"\nTotal rows in vessel_positions: {total_count}")
-    
-    # Count unique vessels
-    response = supabase.table('vessel_positions').select('mmsi').execute()
-    unique_mmsi = set(row['mmsi'] for row in response.data)
-    print(f"Unique MMSIs (first 1000): {len(unique_mmsi)}")
-    
-    # Get timestamp range
-    response = supabase.table('vessel_positions')\
-        .select('timestamp')\
-        .order('timestamp', desc=False)\
-        .limit(1)\
-        .execute()
-    
-    if response.data:
-        print(f"Oldest record: {response.data[0]['timestamp']}")
-    
-    response = supabase.table('vessel_positions')\
-        .select('timestamp')\
-        .order('timestamp', desc=True)\
-        .limit(1)\
-        .execute()
-    
-    if response.data:
-        print(f"Newest record: {response.data[0]['timestamp']}")
+    before = load_sketch(supabase).estimate()
+    mmsis = supabase.rpc('vessel_distinct_mmsi', {}).execute().data or []
+    after = update_mmsi_sketch(supabase, mmsis)
+    print(f"Seeded MMSI sketch with {len(mmsis)} stored MMSIs: estimate {before} -> {after}")
+
+
+def print_stats(stats, age):
+    print(f"Connecting to: {SUPABASE_URL}")
+    if age > 0:
+        print(f"(cached {age:.0f}s ago)")
+
+    rows = stats.get('estimated_rows')
+    print(f"\nEstimated rows in vessel_positions: {rows if rows is not None else 'unknown (not analyzed yet)'}")
+    if stats.get('exact'):
+        print(f"Exact rows in vessel_positions: {stats['rows']}")
+
+    print(f"Table size: {_format_bytes(stats.get('table_bytes'))}, "
+          f"indexes: {_format_bytes(stats.get('index_bytes'))}, "
+          f"total: {_format_bytes(stats.get('total_bytes'))}")
+
+    print(f"Unique MMSIs ingested (HyperLogLog estimate): {stats['estimated_unique_mmsi']}")
+    if stats.get('exact'):
+        print(f"Unique MMSIs stored (exact): {stats['unique_mmsi']}")
+
+    if stats.get('oldest'):
+        print(f"Oldest record: {stats['oldest']}")
+    if stats.get('newest'):
+        print(f"Newest record: {stats['newest']}")
+    if stats.get('last_analyze'):
+        print(f"Statistics last analyzed: {stats['last_analyze']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Database health and statistics')
+    parser.add_argument('--exact', action='store_true', help='also run exact counts (scans the table)')
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL, help='cache lifetime in seconds (0 disables)')
+    parser.add_argument('--json', action='store_true', help='print raw JSON')
+    parser.add_argument('--seed-sketch', action='store_true',
+                        help='one-off: add all stored MMSIs to the sketch (scans the table)')
+    args = parser.parse_args()
+
+    if args.seed_sketch:
+        if not SUPABASE_KEY:
+            print("NO KEY SET! Set SUPABASE_KEY")
+            raise SystemExit(1)
+        seed_sketch()
+        if os.path.exists(CACHE_FILE):
+            os.remove(CACHE_FILE)
+        return
+
+    stats = read_cache(args.exact, args.ttl) if args.ttl > 0 else None
+    if stats is None:
+        if not SUPABASE_KEY:
+            print("NO KEY SET! Set SUPABASE_KEY")
+            raise SystemExit(1)
+        stats = collect_stats(args.exact)
+        if args.ttl > 0:
+            write_cache(stats)
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print_stats(stats, time.time() - stats['fetched_at'])
+
 
 if __name__ == '__main__':
     main()
@@ -8,8 +8,18 @@ import json
 import requests
 from datetime import datetime, timezone
 import os
+import sys
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from territory import find_territorial_country
+from detector_utils import report_time
+from regions import load_regions, assign_regions
+import anchor_watch
+from encounters import detect_encounters, ENCOUNTER_DISTANCE_M
+from rollups import apply_rollups
+from mmsi_sketch import update_mmsi_sketch
+from port_calls import PortIndex, detect_port_calls
+import spool
 # Optional parser for flexible ETA formats
 try:
     from dateutil import parser as dateutil_parser
@@ -17,6 +27,7 @@ except Exception:
     dateutil_parser = None
 
 # Baltic Sea bounding box (same as map bounds)
+# Used as the single default region unless AIS_REGIONS_FILE is set (see regions.py)
 BBOX = {
     'min_lon': 17.0,
     'max_lon': 30.3,
@@ -24,6 +35,12 @@ BBOX = {
     'max_lat': 66.0
 }
 
+# Per-region snapshots are written here; the merged one stays in data/ais/latest.json
+REGION_SNAPSHOT_DIR = Path('data/ais/regions')
+
+# Worker processes for per-region tagging/export (0 = one per CPU)
+MAX_WORKERS = int(os.environ.get('AIS_WORKERS', '0')) or (os.cpu_count() or 1)
+
 # Supabase configuration
 SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://baeebralrmgccruigyle.supabase.co')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')  # Use new secret key from Supabase dashboard
@@ -108,134 +125,298 @@ def _normalize_eta(eta_raw):
         except Exception:
             return None
 
-def filter_vessels(data):
-    """Filter moving vessels within Baltic Sea region"""
+def filter_region_vessels(data, regions=None):
+    """Filter all vessels, moving or not, within the collection regions"""
     if not data or 'features' not in data:
         return []
+    if regions is None:
+        regions = load_regions(BBOX)
     
     filtered = []
     for feature in data['features']:
         coords = feature['geometry']['coordinates']
         lon, lat = coords[0], coords[1]
-        props = feature['properties']
-        sog = props.get('sog', 0)
-        
-        # Check if within bounding box AND moving (SOG > 0.5 knots)
-        if (BBOX['min_lon'] <= lon <= BBOX['max_lon'] and 
-            BBOX['min_lat'] <= lat <= BBOX['max_lat'] and
-            sog > 0.5):
+        if any(r.contains(lon, lat) for r in regions):
             filtered.append(feature)
     
     return filtered
 
-def save_to_database(vessels, vessel_metadata, timestamp, collection_time_ms):
-    """Save vessel data to Supabase database"""
+def is_moving(feature):
+    """Moving = SOG > 0.5 knots; stationary vessels are left to anchor_watch"""
+    return (feature['properties'].get('sog') or 0) > 0.5
+
+def filter_vessels(data, regions=None):
+    """Filter moving vessels within the collection regions"""
+    return [f for f in filter_region_vessels(data, regions) if is_moving(f)]
+
+def build_vessel_row(feature, meta, timestamp_str):
+    """Build one vessel_positions row (with territory tagging) from a GeoJSON feature"""
+    props = feature['properties']
+    coords = feature['geometry']['coordinates']
+    # Normalize ETA to timestamptz-friendly ISO string
+    eta_norm = _normalize_eta(meta.get('eta'))
+    # Determine territorial country (if any)
+    try:
+        territorial_country_code = find_territorial_country(coords[0], coords[1])
+    except Exception:
+        territorial_country_code = None
+
+    return {
+        'timestamp': timestamp_str,
+        'report_time': report_time(props, timestamp_str),
+        'mmsi': props.get('mmsi'),
+        'name': meta.get('name'),
+        'longitude': coords[0],
+        'latitude': coords[1],
+        'sog': props.get('sog'),
+        'cog': props.get('cog'),
+        'heading': props.get('heading'),
+        'nav_stat': props.get('navStat'),
+        'ship_type': meta.get('ship_type'),
+        'destination': meta.get('destination'),
+        'eta': eta_norm,
+        'draught': meta.get('draught'),
+        'pos_acc': props.get('posAcc'),
+        'territorial_water_country_code': territorial_country_code,
+        # PostGIS point for the spatial index (sql/migrations/008_spatial_index.sql)
+        'geom': f"SRID=4326;POINT({coords[0]} {coords[1]})"
+    }
+
+def enrich_vessels(vessels, vessel_metadata, timestamp):
+    """Tag every vessel with metadata and territory, returning vessel_positions rows"""
+    timestamp_str = timestamp.isoformat()
+    return [
+        build_vessel_row(f, vessel_metadata.get(f['properties'].get('mmsi'), {}), timestamp_str)
+        for f in vessels
+    ]
+
+def snapshot_vessel(row):
+    """Convert a vessel_positions row to its latest.json entry"""
+    return {
+        'mmsi': row['mmsi'],
+        'name': row['name'],
+        'lon': row['longitude'],
+        'lat': row['latitude'],
+        'sog': row['sog'],
+        'cog': row['cog'],
+        'heading': row['heading'],
+        'ship_type': row['ship_type'],
+        'destination': row['destination'],
+        'eta': row['eta'],
+        'territorial_water_country_code': row['territorial_water_country_code']
+    }
+
+def write_snapshot(path, rows, timestamp, extra=None):
+    """Write a latest.json-style snapshot of vessel rows to path (extra: additional top-level keys)"""
+    vessel_list = [snapshot_vessel(row) for row in rows]
+    
+    output = {
+        'timestamp': timestamp.isoformat(),
+        'vessel_count': len(vessel_list),
+        'vessels': vessel_list
+    }
+    if extra:
+        output.update(extra)
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    
+    return len(vessel_list)
+
+def process_region(region_name, vessels, vessel_metadata, timestamp):
+    """Tag one region's vessels and write its snapshot (runs in a worker process)"""
+    rows = enrich_vessels(vessels, vessel_metadata, timestamp)
+    write_snapshot(REGION_SNAPSHOT_DIR / f'{region_name}.json', rows, timestamp)
+    return region_name, rows
+
+def process_regions(shards, vessel_metadata, timestamp):
+    """Run process_region for every shard, across a process pool when worthwhile
+
+    Returns {region name: rows}. Each worker only receives its own shard and
+    the metadata for the vessels in it, and loads the territory geometries once.
+    """
+    jobs = []
+    for name, vessels in shards.items():
+        meta = {}
+        for f in vessels:
+            mmsi = f['properties'].get('mmsi')
+            if mmsi in vessel_metadata:
+                meta[mmsi] = vessel_metadata[mmsi]
+        jobs.append((name, vessels, meta, timestamp))
+    
+    workers = min(MAX_WORKERS, len(jobs))
+    if workers <= 1:
+        return dict(process_region(*job) for job in jobs)
+    
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_region, *job) for job in jobs]
+        for future in as_completed(futures):
+            name, rows = future.result()
+            results[name] = rows
+            print(f"  Region {name}: {len(rows)} vessels")
+    return results
+
+def merge_region_rows(region_rows, regions):
+    """Merge per-region rows in region order, keeping one row per MMSI"""
+    merged = []
+    seen = set()
+    for region in regions:
+        for row in region_rows.get(region.name, []):
+            if row['mmsi'] in seen:
+                continue
+            seen.add(row['mmsi'])
+            merged.append(row)
+    return merged
+
+def insert_positions(supabase, vessel_rows):
+    """Insert vessel_positions rows, returning the rows actually inserted
+
+    Insert-or-ignore on (mmsi, report_time): a vessel whose last report is
+    already stored is skipped instead of stored again.
+    """
+    inserted_rows = []
+    # Batch insert vessels (Supabase has 1000 row limit per request)
+    batch_size = 1000
+    for i in range(0, len(vessel_rows), batch_size):
+        batch = vessel_rows[i:i + batch_size]
+        result = supabase.table('vessel_positions')\
+            .upsert(batch, on_conflict='mmsi,report_time', ignore_duplicates=True)\
+            .execute()
+        inserted_rows.extend(result.data or [])
+        print(f"Inserted batch {i//batch_size + 1}: {len(result.data or [])} new of {len(batch)} vessels")
+    return inserted_rows
+
+def update_aggregates(supabase, inserted_rows, collection_times=None):
+    """Fold newly inserted rows into the hourly rollups and the MMSI sketch
+
+    collection_times: timestamps of the collection summaries behind the rows;
+    other rows count as streamed (see rollups.compute_rollups).
+    """
+    # Dashboard rollups; if this fails, `python rollups.py backfill` repairs them
+    try:
+        n = apply_rollups(supabase, inserted_rows, collection_times)
+        print(f"✓ Updated {n} hourly rollup rows")
+    except Exception as e:
+        print(f"Warning: could not update hourly rollups: {e}")
+    
+    # Distinct-MMSI sketch read by check_database.py
+    try:
+        estimate = update_mmsi_sketch(supabase, [row['mmsi'] for row in inserted_rows])
+        print(f"✓ Updated MMSI sketch (~{estimate} distinct vessels)")
+    except Exception as e:
+        print(f"Warning: could not update MMSI sketch: {e}")
+
+def upload_spooled(supabase, vessel_rows, summaries, aggregate=True):
+    """Upload rows and collection summaries from the spool (safe to repeat)
+
+    Returns the newly inserted rows. With aggregate=False the caller folds
+    them into the rollups and sketch itself (stream_ais.py batches that).
+    """
+    inserted_rows = insert_positions(supabase, vessel_rows)
+    if summaries:
+        supabase.table('collection_summary').upsert(summaries, on_conflict='timestamp').execute()
+    
+    print(f"✓ Saved {len(inserted_rows)} new positions to Supabase "
+          f"({len(vessel_rows) - len(inserted_rows)} unchanged reports skipped)")
+    
+    if aggregate:
+        update_aggregates(supabase, inserted_rows, [s['timestamp'] for s in summaries])
+    return inserted_rows
+
+def save_to_database(vessel_rows, timestamp, collection_time_ms):
+    """Save vessel data to Supabase database, via the local spool
+
+    Returns False if the upload failed; the rows then stay in the spool and
+    are replayed by the next run.
+    """
     supabase = get_supabase_client()
     if not supabase:
         print("Skipping database save - Supabase not available")
-        return
+        return True
     
-    timestamp_str = timestamp.isoformat()
+    summary = {
+        'timestamp': timestamp.isoformat(),
+        'vessel_count': len(vessel_rows),
+        'collection_time_ms': collection_time_ms
+    }
+    segment = spool.write_segment(vessel_rows, summary)
+    print(f"Spooled {len(vessel_rows)} vessels to {segment}")
     
     try:
-        # Prepare vessel data for batch insert
-        vessel_data = []
-        for feature in vessels:
-            props = feature['properties']
-            coords = feature['geometry']['coordinates']
-            mmsi = props.get('mmsi')
-            
-            # Get metadata if available
-            meta = vessel_metadata.get(mmsi, {})
-            # Normalize ETA to timestamptz-friendly ISO string
-            eta_norm = _normalize_eta(meta.get('eta'))
-            # Determine territorial country (if any)
-            try:
-                territorial_country_code = find_territorial_country(coords[0], coords[1])
-            except Exception:
-                territorial_country_code = None
-
-            vessel_data.append({
-                'timestamp': timestamp_str,
-                'mmsi': mmsi,
-                'name': meta.get('name'),
-                'longitude': coords[0],
-                'latitude': coords[1],
-                'sog': props.get('sog'),
-                'cog': props.get('cog'),
-                'heading': props.get('heading'),
-                'nav_stat': props.get('navStat'),
-                'ship_type': meta.get('ship_type'),
-                'destination': meta.get('destination'),
-                'eta': eta_norm,
-                'draught': meta.get('draught'),
-                'pos_acc': props.get('posAcc'),
-                'territorial_water_country_code': territorial_country_code
-            })
-        
-        # Batch insert vessels (Supabase has 1000 row limit per request)
-        batch_size = 1000
-        for i in range(0, len(vessel_data), batch_size):
-            batch = vessel_data[i:i + batch_size]
-            result = supabase.table('vessel_positions').insert(batch).execute()
-            print(f"Inserted batch {i//batch_size + 1}: {len(batch)} vessels")
-        
-        # Insert collection summary
-        summary = {
-            'timestamp': timestamp_str,
-            'vessel_count': len(vessels),
-            'collection_time_ms': collection_time_ms
-        }
-        supabase.table('collection_summary').insert(summary).execute()
-        
-        print(f"✓ Saved {len(vessels)} vessels to Supabase")
-        
+        spool.replay_pending(lambda rows, summaries: upload_spooled(supabase, rows, summaries))
     except Exception as e:
+        pending = len(spool.pending_segments())
         print(f"Error saving to Supabase: {e}")
-        raise
+        print(f"{pending} spooled segment(s) will be replayed on the next run")
+        return False
+    return True
 
-def export_latest_json(vessels, vessel_metadata, timestamp):
-    """Export latest data as JSON for web access"""
-    latest_file = Path('data/ais/latest.json')
-    
-    # Build simplified vessel list
-    vessel_list = []
-    for feature in vessels:
-        props = feature['properties']
-        coords = feature['geometry']['coordinates']
-        mmsi = props.get('mmsi')
-        meta = vessel_metadata.get(mmsi, {})
-        try:
-            territorial_country_code = find_territorial_country(coords[0], coords[1])
-        except Exception:
-            territorial_country_code = None
-
-        eta_norm = _normalize_eta(meta.get('eta'))
-
-        vessel_list.append({
-            'mmsi': mmsi,
-            'name': meta.get('name'),
-            'lon': coords[0],
-            'lat': coords[1],
-            'sog': props.get('sog'),
-            'cog': props.get('cog'),
-            'heading': props.get('heading'),
-            'ship_type': meta.get('ship_type'),
-            'destination': meta.get('destination'),
-            'eta': eta_norm,
-            'territorial_water_country_code': territorial_country_code
-        })
-    
+def save_encounters(encounters):
+    """Save this collection's close-approach pairs to Supabase"""
+    if not encounters:
+        return
+    supabase = get_supabase_client()
+    if not supabase:
+        print("Skipping encounter save - Supabase not available")
+        return
+    try:
+        batch_size = 1000
+        for i in range(0, len(encounters), batch_size):
+            supabase.table('vessel_encounters').insert(encounters[i:i + batch_size]).execute()
+        print(f"✓ Saved {len(encounters)} encounters")
+    except Exception as e:
+        # Encounters are also in latest.json; don't fail the collection
+        print(f"Warning: could not save encounters: {e}")
+
+def save_port_calls(events):
+    """Save port arrival/departure events to Supabase"""
+    if not events:
+        return
+    supabase = get_supabase_client()
+    if not supabase:
+        print("Skipping port call save - Supabase not available")
+        return
+    try:
+        supabase.table('port_calls').insert(events).execute()
+        print(f"✓ Saved {len(events)} port call events")
+    except Exception as e:
+        print(f"Warning: could not save port call events: {e}")
+
+def save_anchor_alerts(alerts):
+    """Save anchor-drag alerts to Supabase"""
+    if not alerts:
+        return
+    supabase = get_supabase_client()
+    if not supabase:
+        print("Skipping anchor alert save - Supabase not available")
+        return
+    try:
+        supabase.table('anchor_drag_alerts').insert(alerts).execute()
+        print(f"✓ Saved {len(alerts)} anchor-drag alerts")
+    except Exception as e:
+        # Alerts are also in anchor_alerts.json; don't fail the collection
+        print(f"Warning: could not save anchor-drag alerts: {e}")
+
+def export_anchor_alerts(alerts, anchored_count, timestamp):
+    """Export this collection's anchor-drag alerts as JSON"""
     output = {
         'timestamp': timestamp.isoformat(),
-        'vessel_count': len(vessel_list),
-        'vessels': vessel_list
+        'anchored_count': anchored_count,
+        'alert_count': len(alerts),
+        'alerts': alerts
     }
-    
-    with open(latest_file, 'w') as f:
+    with open(Path('data/ais/anchor_alerts.json'), 'w') as f:
         json.dump(output, f, indent=2)
-    
-    print(f"Exported latest.json with {len(vessel_list)} vessels")
+
+def export_latest_json(vessel_rows, timestamp, encounters=None):
+    """Export latest data as JSON for web access"""
+    extra = None
+    if encounters is not None:
+        extra = {'encounter_count': len(encounters), 'encounters': encounters}
+    count = write_snapshot(Path('data/ais/latest.json'), vessel_rows, timestamp, extra)
+    print(f"Exported latest.json with {count} vessels")
 
 def main():
     """Main collection routine"""
@@ -247,6 +428,8 @@ def main():
     timestamp = start_time
     print(f"Collection time: {timestamp.isoformat()}")
     
+    regions = load_regions(BBOX)
+    
     # Fetch data
     print("Fetching AIS data from Digitraffic...")
     data = fetch_ais_data()
@@ -255,29 +438,59 @@ def main():
         print("Failed to fetch data")
         return
     
-    # Filter to Baltic region
-    print("Filtering vessels in Baltic Sea region...")
-    vessels = filter_vessels(data)
+    # Filter to collection regions
+    print(f"Filtering vessels in {len(regions)} region(s)...")
+    region_vessels = filter_region_vessels(data, regions)
+    vessels = [f for f in region_vessels if is_moving(f)]
     print(f"Found {len(vessels)} vessels in region")
     
+    # Anchor watch sees stationary vessels too
+    print("Checking anchored vessels for anchor drag...")
+    anchor_alerts, anchored_count = anchor_watch.process_snapshot(region_vessels, timestamp)
+    print(f"{anchored_count} vessels at anchor, {len(anchor_alerts)} new drag alerts")
+    
+    # Port arrivals/departures, one batched harbour lookup for all vessels
+    port_events, in_port = detect_port_calls(region_vessels, timestamp, PortIndex.load())
+    print(f"{in_port} vessels in port, {len(port_events)} arrival/departure events")
+    
     # Fetch vessel metadata (names, types, etc.)
     print("Fetching vessel metadata...")
     mmsi_list = [f['properties']['mmsi'] for f in vessels]
     vessel_metadata = fetch_vessel_metadata(mmsi_list)
     print(f"Retrieved metadata for {len(vessel_metadata)} vessels")
     
+    # Territory tagging and per-region export, sharded across processes
+    print("Tagging territories per region...")
+    shards = assign_regions(vessels, regions)
+    region_rows = process_regions(shards, vessel_metadata, timestamp)
+    vessel_rows = merge_region_rows(region_rows, regions)
+    
+    # Close approaches between moving vessels
+    encounters = detect_encounters(vessel_rows, timestamp)
+    persistent = sum(1 for e in encounters if e['snapshots'] > 1)
+    print(f"Found {len(encounters)} encounters within {ENCOUNTER_DISTANCE_M:.0f} m ({persistent} persistent)")
+    
     # Calculate collection time
     collection_time = datetime.now(timezone.utc) - start_time
     collection_time_ms = int(collection_time.total_seconds() * 1000)
     
     # Save to Supabase
-    save_to_database(vessels, vessel_metadata, timestamp, collection_time_ms)
+    saved = save_to_database(vessel_rows, timestamp, collection_time_ms)
+    
+    save_encounters(encounters)
+    save_anchor_alerts(anchor_alerts)
+    save_port_calls(port_events)
     
     # Export latest JSON
-    export_latest_json(vessels, vessel_metadata, timestamp)
+    export_latest_json(vessel_rows, timestamp, encounters)
+    export_anchor_alerts(anchor_alerts, anchored_count, timestamp)
     
     print(f"Collection complete in {collection_time_ms}ms!")
     print("=" * 60)
+    
+    if not saved:
+        # Everything else was exported; fail the run so the outage is visible
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,50 @@
+"""
+Helpers shared by the collection-time detectors (anchor_watch.py,
+encounters.py, port_calls.py) and the row builder in collect_ais.py
+
+- JSON state files kept between runs, written atomically
+- Report times of Digitraffic location features (timestampExternal, epoch ms)
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+def load_json_state(path, owner):
+    """Load a JSON state file; missing or unreadable files give an empty state"""
+    try:
+        with open(path, 'r') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f'{owner}: could not load state ({e}), starting fresh')
+        return {}
+
+
+def save_json_state(path, state):
+    """Write a JSON state file via a temporary file and rename"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+def fix_time(props, fallback):
+    """Epoch seconds of a Digitraffic location feature (timestampExternal is in ms)"""
+    ts = props.get('timestampExternal')
+    if ts:
+        return ts / 1000.0
+    return fallback
+
+
+def report_time(props, fallback):
+    """The vessel's own report time as UTC ISO8601, or fallback (an ISO string)"""
+    ts = props.get('timestampExternal')
+    if not ts:
+        return fallback
+    return datetime.fromtimestamp(ts / 1000, timezone.utc).isoformat()
@@ -0,0 +1,141 @@
+"""
+Close-approach (encounter) detection between vessels
+
+Positions are bucketed into a uniform grid whose cells are at least
+ENCOUNTER_DISTANCE_M wide everywhere in the snapshot, so any two vessels
+within that distance are in the same or adjacent cells. Each cell is compared
+only with itself and four of its neighbours (the other four are covered from
+the other side), so an ~8,000 vessel snapshot costs a few thousand distance
+checks (milliseconds) instead of the ~30M of an all-pairs comparison.
+
+Pairs that were also close in the previous snapshot are reported as
+persistent, with the number of consecutive snapshots they have been close.
+State is kept between runs in ENCOUNTER_STATE_FILE (cached by the collect-ais
+workflow); if it is lost, every pair starts again at one snapshot.
+"""
+
+import math
+import os
+
+from detector_utils import load_json_state, save_json_state
+
+ENCOUNTER_DISTANCE_M = float(os.environ.get('ENCOUNTER_DISTANCE_M', '200'))
+ENCOUNTER_STATE_FILE = os.environ.get('ENCOUNTER_STATE_FILE', 'data/ais/encounter_state.json')
+
+EARTH_RADIUS_M = 6371000.0
+_M_PER_DEG = math.pi * EARTH_RADIUS_M / 180.0
+
+# Own cell plus half of the 8-neighbourhood, so every cell pair is visited once
+_HALF_NEIGHBOURS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def distance_m(lon1, lat1, lon2, lat2):
+    """Equirectangular distance in metres (accurate at encounter ranges)"""
+    x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.hypot(x, y) * _M_PER_DEG
+
+
+def find_close_pairs(points, max_distance_m=ENCOUNTER_DISTANCE_M):
+    """Return [(i, j, distance_m)] for all index pairs of points within max_distance_m
+
+    points is a sequence of (lon, lat).
+    """
+    if len(points) < 2:
+        return []
+
+    # Size cells for the highest latitude, where a degree of longitude is
+    # shortest, so cells are never narrower than max_distance_m
+    max_lat = max(abs(lat) for _, lat in points)
+    cell_lat = max_distance_m / _M_PER_DEG
+    cell_lon = max_distance_m / (_M_PER_DEG * max(math.cos(math.radians(max_lat)), 1e-6))
+
+    grid = {}
+    for i, (lon, lat) in enumerate(points):
+        key = (int(math.floor(lon / cell_lon)), int(math.floor(lat / cell_lat)))
+        bucket = grid.get(key)
+        if bucket is None:
+            grid[key] = [i]
+        else:
+            bucket.append(i)
+
+    # Compare in degrees of latitude with the longitude difference scaled by
+    # the first point's cos(lat); only hits pay for a sqrt
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    coss = [math.cos(math.radians(lat)) for lat in lats]
+    max_d2 = cell_lat * cell_lat
+
+    pairs = []
+    for (cx, cy), bucket in grid.items():
+        for dx, dy in _HALF_NEIGHBOURS:
+            if dx == 0 and dy == 0:
+                # Pairs within the cell itself
+                for a in range(len(bucket) - 1):
+                    i = bucket[a]
+                    lon1, lat1, c1 = lons[i], lats[i], coss[i]
+                    for j in bucket[a + 1:]:
+                        ex = (lons[j] - lon1) * c1
+                        ey = lats[j] - lat1
+                        d2 = ex * ex + ey * ey
+                        if d2 <= max_d2:
+                            pairs.append((i, j, math.sqrt(d2) * _M_PER_DEG))
+                continue
+            other = grid.get((cx + dx, cy + dy))
+            if other is None:
+                continue
+            for i in bucket:
+                lon1, lat1, c1 = lons[i], lats[i], coss[i]
+                for j in other:
+                    ex = (lons[j] - lon1) * c1
+                    ey = lats[j] - lat1
+                    d2 = ex * ex + ey * ey
+                    if d2 <= max_d2:
+                        pairs.append((i, j, math.sqrt(d2) * _M_PER_DEG))
+    return pairs
+
+
+def detect_encounters(vessel_rows, timestamp, max_distance_m=ENCOUNTER_DISTANCE_M,
+                      state_file=ENCOUNTER_STATE_FILE):
+    """Find vessel pairs within max_distance_m in this snapshot
+
+    vessel_rows are vessel_positions rows (see collect_ais.build_vessel_row).
+    Returns a list of encounter dicts, closest first. `snapshots` counts how
+    many consecutive collections the pair has been close; > 1 means persistent.
+    """
+    timestamp_str = timestamp.isoformat()
+    points = [(row['longitude'], row['latitude']) for row in vessel_rows]
+    previous = load_json_state(state_file, 'encounters.py')
+
+    state = {}
+    encounters = []
+    for i, j, d in find_close_pairs(points, max_distance_m):
+        a, b = vessel_rows[i], vessel_rows[j]
+        if a['mmsi'] == b['mmsi']:
+            continue
+        if a['mmsi'] > b['mmsi']:
+            a, b = b, a
+        key = f"{a['mmsi']}-{b['mmsi']}"
+        prev = previous.get(key)
+        first_seen = prev['first_seen'] if prev else timestamp_str
+        snapshots = prev['snapshots'] + 1 if prev else 1
+        state[key] = {'first_seen': first_seen, 'snapshots': snapshots}
+
+        encounters.append({
+            'timestamp': timestamp_str,
+            'mmsi_a': a['mmsi'],
+            'mmsi_b': b['mmsi'],
+            'distance_m': round(d, 1),
+            'lon': round((a['longitude'] + b['longitude']) / 2, 6),
+            'lat': round((a['latitude'] + b['latitude']) / 2, 6),
+            'sog_a': a['sog'],
+            'sog_b': b['sog'],
+            'first_seen': first_seen,
+            'snapshots': snapshots
+        })
+
+    # Pairs that are no longer close drop out of the state, so only
+    # consecutive snapshots count towards persistence
+    save_json_state(state_file, state)
+    encounters.sort(key=lambda e: e['distance_m'])
+    return encounters
@@ -0,0 +1,179 @@
+"""
+Port-call detection (arrivals and departures) per collection cycle
+
+Harbours are loaded from PORTS_FILE (ports.geojson): polygons, or points with
+a `radius_m` property that are turned into circles. Every feature needs an
+`id`; `locode` and `name` are carried into the events. The areas go into a
+Shapely STRtree once, and each cycle all vessel positions are matched against
+it in a single bulk query, with no per-vessel scan over the harbours.
+
+LOGIC (per vessel, per cycle):
+- Arrival: the vessel is slow (SOG <= PORT_SOG) or reports navStat 1/5
+  (at anchor / moored) inside a harbour it is not already recorded in.
+- Departure: a vessel recorded in a harbour is seen outside it (or arrives
+  in a different one).
+- Vessels not seen for STALE_HOURS are forgotten without an event.
+
+Open calls are kept between runs in PORT_STATE_FILE (cached by the
+collect-ais workflow). Without that file there is no way to tell a new
+arrival from a vessel that has been in port all along, so the first run
+seeds the open calls without emitting arrivals. If Shapely is not installed,
+detection is disabled.
+"""
+
+import json
+import math
+import os
+from datetime import datetime
+from pathlib import Path
+
+from detector_utils import load_json_state, report_time, save_json_state
+
+try:
+    import shapely
+    from shapely.geometry import shape
+    from shapely.affinity import scale
+    from shapely.strtree import STRtree
+except Exception:
+    shapely = None
+
+PORTS_FILE = os.environ.get('PORTS_FILE', 'ports.geojson')
+PORT_STATE_FILE = os.environ.get('PORT_STATE_FILE', 'data/ais/port_state.json')
+
+PORT_SOG = 1.0                 # knots
+NAV_STAT_IN_PORT = (1, 5)      # at anchor, moored
+STALE_HOURS = 48
+
+_M_PER_DEG = math.pi * 6371000.0 / 180.0
+
+
+class PortIndex:
+    """Harbour areas in an STRtree, matched against many positions at once"""
+
+    def __init__(self, ports, geometries):
+        self.ports = ports          # list of {'id', 'locode', 'name'}
+        self.geometries = geometries
+        self.tree = STRtree(geometries)
+
+    @classmethod
+    def load(cls, path=PORTS_FILE):
+        if shapely is None:
+            print('port_calls.py: shapely not available - port calls disabled')
+            return None
+        p = Path(path)
+        if not p.exists():
+            print(f'port_calls.py: {path} not found - port calls disabled')
+            return None
+
+        with open(p, 'r', encoding='utf-8') as fh:
+            gj = json.load(fh)
+
+        ports, geometries = [], []
+        for feat in gj.get('features', []):
+            props = feat.get('properties', {}) or {}
+            geom = feat.get('geometry')
+            if not geom or not props.get('id'):
+                continue
+            g = shape(geom)
+            if g.geom_type == 'Point':
+                # Circle of radius_m, stretched in longitude for the latitude
+                r_deg = props.get('radius_m', 2000) / _M_PER_DEG
+                g = scale(g.buffer(r_deg, quad_segs=8),
+                          xfact=1 / math.cos(math.radians(g.y)), yfact=1, origin=g)
+            ports.append({'id': props['id'], 'locode': props.get('locode'),
+                          'name': props.get('name')})
+            geometries.append(g)
+
+        if not geometries:
+            print(f'port_calls.py: no ports in {path}')
+            return None
+        print(f'port_calls.py: loaded {len(ports)} ports from {path}')
+        return cls(ports, geometries)
+
+    def match(self, lons, lats):
+        """Return the port index for each position (None outside all ports)"""
+        result = [None] * len(lons)
+        if not lons:
+            return result
+        points = shapely.points(lons, lats)
+        pt_idx, port_idx = self.tree.query(points, predicate='within')
+        for i, j in zip(pt_idx.tolist(), port_idx.tolist()):
+            # Overlapping areas: keep the first match
+            if result[i] is None:
+                result[i] = j
+        return result
+
+
+def _event(kind, mmsi, port, when, lon, lat, arrived=None):
+    event = {
+        'mmsi': mmsi,
+        'port_id': port['id'],
+        'locode': port['locode'],
+        'port_name': port['name'],
+        'event': kind,
+        'time': when,
+        'lon': lon,
+        'lat': lat,
+        'duration_s': None
+    }
+    if arrived:
+        event['duration_s'] = int((datetime.fromisoformat(when)
+                                   - datetime.fromisoformat(arrived)).total_seconds())
+    return event
+
+
+def detect_port_calls(features, timestamp, index, state_file=PORT_STATE_FILE):
+    """Match one snapshot of GeoJSON features against the harbours
+
+    features should include stationary vessels (collect_ais.filter_region_vessels).
+    Returns (events, vessels currently in port).
+    """
+    if index is None:
+        return [], 0
+
+    timestamp_str = timestamp.isoformat()
+    cold_start = not Path(state_file).exists()
+    state = load_json_state(state_file, 'port_calls.py')
+    by_id = {p['id']: p for p in index.ports}
+
+    lons = [f['geometry']['coordinates'][0] for f in features]
+    lats = [f['geometry']['coordinates'][1] for f in features]
+    matches = index.match(lons, lats)
+
+    events = []
+    for feature, lon, lat, j in zip(features, lons, lats, matches):
+        props = feature['properties']
+        mmsi = props.get('mmsi')
+        key = str(mmsi)
+        when = report_time(props, timestamp_str)
+        current = state.get(key)
+        here = index.ports[j] if j is not None else None
+
+        if current:
+            current['last_seen'] = timestamp_str
+            if here is None or here['id'] != current['port_id']:
+                port = by_id.get(current['port_id'], {'id': current['port_id'],
+                                                       'locode': None, 'name': None})
+                events.append(_event('departure', mmsi, port, when, lon, lat, current['arrival']))
+                del state[key]
+                current = None
+
+        if here is not None and current is None:
+            slow = (props.get('sog') or 0) <= PORT_SOG or props.get('navStat') in NAV_STAT_IN_PORT
+            if slow and cold_start:
+                # Already in port when we started watching: arrival time unknown
+                state[key] = {'port_id': here['id'], 'arrival': None, 'last_seen': timestamp_str}
+            elif slow:
+                state[key] = {'port_id': here['id'], 'arrival': when, 'last_seen': timestamp_str}
+                events.append(_event('arrival', mmsi, here, when, lon, lat))
+
+    if cold_start:
+        print(f'port_calls.py: no {state_file}, seeded {len(state)} open calls without arrival events')
+
+    now = timestamp.timestamp()
+    for key in [k for k, v in state.items()
+                if now - datetime.fromisoformat(v['last_seen']).timestamp() > STALE_HOURS * 3600]:
+        del state[key]
+
+    save_json_state(state_file, state)
+    return events, len(state)
@@ -0,0 +1,141 @@
+"""
+Collection regions for the AIS collector.
+
+A region is either a plain rectangle or a GeoJSON polygon. The default is the
+single Baltic rectangle that `collect_ais.BBOX` has always used; set
+AIS_REGIONS_FILE to a GeoJSON FeatureCollection (see regions_example.geojson)
+to collect several named regions instead.
+
+Each feature needs a `name` property. Polygon features are tested with
+prepared Shapely geometries behind a cheap bounding-box pre-check; if Shapely
+is not installed only the bounding box is used.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+try:
+    from shapely.geometry import shape, Point
+    from shapely.prepared import prep
+except Exception:
+    shape = None
+    Point = None
+    prep = None
+
+
+REGIONS_FILE = os.environ.get('AIS_REGIONS_FILE')
+
+# Region names are used as snapshot file names
+_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class Region:
+    """A named collection area with a bbox and an optional prepared polygon"""
+
+    def __init__(self, name, min_lon, min_lat, max_lon, max_lat, geometry=None):
+        self.name = name
+        self.min_lon = min_lon
+        self.min_lat = min_lat
+        self.max_lon = max_lon
+        self.max_lat = max_lat
+        self.geometry = geometry
+        self._prepared = None
+        if geometry is not None and prep is not None:
+            try:
+                self._prepared = prep(geometry)
+            except Exception:
+                self._prepared = None
+
+    @classmethod
+    def from_bbox(cls, name, bbox):
+        return cls(name, bbox['min_lon'], bbox['min_lat'], bbox['max_lon'], bbox['max_lat'])
+
+    @classmethod
+    def from_feature(cls, feature):
+        props = feature.get('properties', {}) or {}
+        name = props.get('name')
+        if not name:
+            raise ValueError('region feature is missing a "name" property')
+        if not _NAME_RE.match(name):
+            raise ValueError(f'invalid region name {name!r} (use letters, digits, _ and -)')
+
+        # Rectangles may be given as a bbox property instead of a geometry
+        bbox = props.get('bbox') or feature.get('bbox')
+        geom = feature.get('geometry')
+        if not geom:
+            if not bbox:
+                raise ValueError(f'region {name!r} has neither geometry nor bbox')
+            return cls(name, *bbox[:4])
+
+        if shape is None:
+            # No Shapely: fall back to the polygon's bounding box
+            lons, lats = [], []
+            _collect_coords(geom.get('coordinates', []), lons, lats)
+            return cls(name, min(lons), min(lats), max(lons), max(lats))
+
+        poly = shape(geom)
+        min_lon, min_lat, max_lon, max_lat = poly.bounds
+        return cls(name, min_lon, min_lat, max_lon, max_lat, geometry=poly)
+
+    def contains(self, lon, lat):
+        if not (self.min_lon <= lon <= self.max_lon and self.min_lat <= lat <= self.max_lat):
+            return False
+        if self._prepared is None:
+            return True
+        return self._prepared.contains(Point(lon, lat))
+
+    def __repr__(self):
+        return f"Region({self.name!r})"
+
+
+def _collect_coords(coords, lons, lats):
+    """Flatten nested GeoJSON coordinate arrays into lon/lat lists"""
+    if coords and isinstance(coords[0], (int, float)):
+        lons.append(coords[0])
+        lats.append(coords[1])
+        return
+    for c in coords:
+        _collect_coords(c, lons, lats)
+
+
+def load_regions(default_bbox, path=None):
+    """Load regions from AIS_REGIONS_FILE, or a single 'baltic' region from default_bbox"""
+    path = path or REGIONS_FILE
+    if not path:
+        return [Region.from_bbox('baltic', default_bbox)]
+
+    p = Path(path)
+    if not p.exists():
+        print(f"regions.py: {path} not found, using default bounding box")
+        return [Region.from_bbox('baltic', default_bbox)]
+
+    with open(p, 'r', encoding='utf-8') as fh:
+        gj = json.load(fh)
+
+    regions = [Region.from_feature(feat) for feat in gj.get('features', [])]
+    names = [r.name for r in regions]
+    if len(set(names)) != len(names):
+        raise ValueError(f'duplicate region names in {path}')
+    if not regions:
+        raise ValueError(f'no regions defined in {path}')
+
+    print(f"regions.py: loaded {len(regions)} regions from {path}")
+    return regions
+
+
+def assign_regions(features, regions):
+    """Split GeoJSON features by region: {region name: [features]}
+
+    A vessel inside overlapping regions is listed in each of them; the merged
+    snapshot de-duplicates by MMSI.
+    """
+    shards = {r.name: [] for r in regions}
+    for feature in features:
+        coords = feature['geometry']['coordinates']
+        lon, lat = coords[0], coords[1]
+        for region in regions:
+            if region.contains(lon, lat):
+                shards[region.name].append(feature)
+    return shards
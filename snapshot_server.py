@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Lightweight snapshot server for the web map
+
+Holds the latest enriched snapshot in memory and serves it over plain
+asyncio HTTP (no extra dependencies), so browsers download changes instead
+of the whole of data/ais/latest.json every time.
+
+Endpoints:
+  GET /snapshot                 full snapshot (latest.json format + "version",
+                                "full": true)
+      ?bbox=min_lon,min_lat,max_lon,max_lat   only vessels inside the box
+      ?since=<version>          only vessels changed after that version, plus
+                                the MMSIs that left ("full": true if the
+                                version is too old to diff against)
+  GET /events                   Server-Sent Events: one "diff" event per
+                                cycle with entered / moved / left vessels
+                                (bbox= applies; reconnects resume from
+                                Last-Event-ID)
+  GET /health
+
+Other top-level keys of the published snapshot (e.g. "encounters" and
+"encounter_count" from latest.json) are passed through unchanged in every
+/snapshot body.
+
+Unfiltered snapshots are serialized and gzip-compressed once per cycle;
+every response carries an ETag (with a -gz suffix for the gzip encoding) and
+If-None-Match gets 304 Not Modified.
+
+Sources:
+  standalone   python snapshot_server.py --file data/ais/latest.json
+               (reloads the file when collect_ais.py rewrites it)
+  with daemon  python stream_ais.py --serve 8080
+               (publishes the in-memory fleet after every micro-batch)
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+HISTORY_VERSIONS = 120       # versions a since= / Last-Event-ID can lag behind
+SSE_QUEUE_SIZE = 16          # diffs buffered per client before it is dropped
+SSE_KEEPALIVE_S = 15
+GZIP_MIN_BYTES = 1024
+REQUEST_TIMEOUT_S = 10
+# Keys the server sets itself; anything else in a snapshot is passed through
+_OWN_KEYS = ('version', 'timestamp', 'full', 'vessel_count', 'vessels', 'left')
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _parse_bbox(value):
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(p) for p in value.split(','))
+    except ValueError:
+        return None
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+def _gzip_etag(etag):
+    """ETag of the gzip-encoded representation (must differ from the identity one)"""
+    return etag[:-1] + '-gz"'
+
+
+def _etag_matches(req_headers, etag):
+    tags = req_headers.get('if-none-match')
+    if not tags:
+        return False
+    return tags.strip() == '*' or etag in (t.strip() for t in tags.split(','))
+
+
+def _inside(vessel, bbox):
+    if vessel is None:
+        return False
+    if bbox is None:
+        return True
+    return bbox[0] <= vessel['lon'] <= bbox[2] and bbox[1] <= vessel['lat'] <= bbox[3]
+
+
+class Diff:
+    """Changes between two consecutive versions, as (old, new) vessel pairs"""
+
+    def __init__(self, version, timestamp, entered, moved, left):
+        self.version = version
+        self.timestamp = timestamp
+        self.entered = entered
+        self.moved = moved
+        self.left = left
+        self._unfiltered = None
+
+    def payload(self, bbox=None):
+        """JSON body of the SSE event, seen through a client's bbox"""
+        if bbox is None and self._unfiltered is not None:
+            return self._unfiltered
+        entered, moved, left = [], [], []
+        for _, new in self.entered:
+            if _inside(new, bbox):
+                entered.append(new)
+        for old, new in self.moved:
+            was, now = _inside(old, bbox), _inside(new, bbox)
+            if was and now:
+                moved.append(new)
+            elif now:
+                entered.append(new)
+            elif was:
+                left.append(old['mmsi'])
+        for old, _ in self.left:
+            if _inside(old, bbox):
+                left.append(old['mmsi'])
+        body = _dumps({'version': self.version, 'timestamp': self.timestamp,
+                       'entered': entered, 'moved': moved, 'left': left})
+        if bbox is None:
+            self._unfiltered = body
+        return body
+
+
+class Subscriber:
+    """One SSE client's bounded queue of diffs"""
+
+    def __init__(self, bbox):
+        self.bbox = bbox
+        self.queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.lagging = False
+
+    def push(self, diff):
+        try:
+            self.queue.put_nowait(diff)
+        except asyncio.QueueFull:
+            # Too slow: drop it; it reconnects and catches up via Last-Event-ID
+            self.lagging = True
+
+
+class SnapshotStore:
+    """The current snapshot, per-vessel change versions and SSE subscribers
+
+    All methods run on the event loop thread.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.timestamp = None
+        self.vessels = {}       # mmsi -> latest.json vessel entry
+        self.extra = {}         # other top-level snapshot keys, served as-is
+        self.changed = {}       # mmsi -> version it last changed
+        self.removed = {}       # mmsi -> version it left
+        self.subscribers = set()
+        # Versions restart at 1 with the process; keeps ETags from matching
+        # content served by an earlier run
+        self.nonce = os.urandom(4).hex()
+        self._set_body()
+
+    def _body(self, full, vessels, **more):
+        return _dumps({'version': self.version, 'timestamp': self.timestamp, 'full': full,
+                       **self.extra, 'vessel_count': len(vessels), 'vessels': vessels, **more})
+
+    def _set_body(self):
+        self.body = self._body(True, list(self.vessels.values()))
+        self.body_gzip = gzip.compress(self.body, compresslevel=6)
+        self.etag = f'"{self.nonce}-v{self.version}-{hashlib.sha1(self.body).hexdigest()[:12]}"'
+
+    def publish(self, snapshot):
+        """Replace the snapshot ({'timestamp', 'vessels': [...]}) and notify subscribers"""
+        new = {v['mmsi']: v for v in snapshot.get('vessels', [])}
+        version = self.version + 1
+
+        entered, moved, left = [], [], []
+        for mmsi, vessel in new.items():
+            old = self.vessels.get(mmsi)
+            if old is None:
+                entered.append((None, vessel))
+                self.changed[mmsi] = version
+                self.removed.pop(mmsi, None)
+            elif old != vessel:
+                moved.append((old, vessel))
+                self.changed[mmsi] = version
+        for mmsi, old in self.vessels.items():
+            if mmsi not in new:
+                left.append((old, None))
+                self.removed[mmsi] = version
+                self.changed.pop(mmsi, None)
+
+        # Forget departures too old for any since= we still answer
+        floor = version - HISTORY_VERSIONS
+        self.removed = {m: v for m, v in self.removed.items() if v > floor}
+
+        self.version = version
+        self.timestamp = snapshot.get('timestamp')
+        self.vessels = new
+        self.extra = {k: v for k, v in snapshot.items() if k not in _OWN_KEYS}
+        self._set_body()
+
+        if entered or moved or left:
+            diff = Diff(version, self.timestamp, entered, moved, left)
+            for sub in self.subscribers:
+                sub.push(diff)
+        return len(entered), len(moved), len(left)
+
+    def can_diff_from(self, since):
+        return self.version - HISTORY_VERSIONS <= since <= self.version
+
+    def since_body(self, since, bbox=None):
+        """Changes after version `since`, optionally limited to a bbox"""
+        vessels, left = [], []
+        for mmsi, ver in self.changed.items():
+            if ver > since:
+                vessel = self.vessels[mmsi]
+                if _inside(vessel, bbox):
+                    vessels.append(vessel)
+                else:
+                    left.append(mmsi)  # may have moved out of the client's box
+        left.extend(m for m, ver in self.removed.items() if ver > since)
+        return self._body(False, vessels, left=left)
+
+    def snapshot_body(self, bbox):
+        return self._body(True, [v for v in self.vessels.values() if _inside(v, bbox)])
+
+
+class SnapshotServer:
+    def __init__(self, store=None):
+        self.store = store or SnapshotStore()
+        self.loop = None
+
+    # -- HTTP plumbing -----------------------------------------------------
+
+    async def _send(self, writer, status, headers, body=b'', head_only=False):
+        lines = [f'HTTP/1.1 {status}']
+        headers = dict(headers)
+        headers.setdefault('Content-Length', str(len(body)))
+        headers.setdefault('Connection', 'close')
+        headers['Access-Control-Allow-Origin'] = '*'
+        for k, v in headers.items():
+            lines.append(f'{k}: {v}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body and not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    async def _send_json(self, writer, req_headers, body, etag, precompressed=None, head_only=False):
+        gzipped = 'gzip' in req_headers.get('accept-encoding', '') and len(body) >= GZIP_MIN_BYTES
+        if gzipped:
+            etag = _gzip_etag(etag)
+        headers = {'Content-Type': 'application/json', 'ETag': etag,
+                   'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if _etag_matches(req_headers, etag):
+            await self._send(writer, '304 Not Modified', {'ETag': etag, 'Content-Length': '0'})
+            return
+        if gzipped:
+            body = precompressed if precompressed is not None else gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        await self._send(writer, '200 OK', headers, body, head_only)
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT_S)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            lines = raw.decode('latin-1').split('\r\n')
+            try:
+                method, target, _ = lines[0].split(' ', 2)
+            except ValueError:
+                await self._send(writer, '400 Bad Request', {})
+                return
+            req_headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    k, v = line.split(':', 1)
+                    req_headers[k.strip().lower()] = v.strip()
+
+            if method not in ('GET', 'HEAD'):
+                await self._send(writer, '405 Method Not Allowed', {'Allow': 'GET, HEAD'})
+                return
+
+            url = urlsplit(target)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            bbox = None
+            if 'bbox' in query:
+                bbox = _parse_bbox(query['bbox'])
+                if bbox is None:
+                    await self._send(writer, '400 Bad Request', {'Content-Type': 'text/plain'},
+                                     b'bbox must be min_lon,min_lat,max_lon,max_lat')
+                    return
+
+            if url.path in ('/snapshot', '/latest.json'):
+                await self._snapshot(writer, req_headers, query, bbox, method == 'HEAD')
+            elif url.path == '/events':
+                await self._events(writer, req_headers, query, bbox)
+            elif url.path == '/health':
+                body = _dumps({'version': self.store.version, 'timestamp': self.store.timestamp,
+                               'vessels': len(self.store.vessels),
+                               'subscribers': len(self.store.subscribers)})
+                await self._send(writer, '200 OK', {'Content-Type': 'application/json'}, body)
+            else:
+                await self._send(writer, '404 Not Found', {})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    # -- endpoints ---------------------------------------------------------
+
+    async def _snapshot(self, writer, req_headers, query, bbox, head_only):
+        store = self.store
+        since = query.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                await self._send(writer, '400 Bad Request', {'Content-Type': 'text/plain'},
+                                 b'since must be a version number')
+                return
+            if not store.can_diff_from(since):
+                since = None  # too old (or from a restarted server): send everything
+
+        if since is None and bbox is None:
+            await self._send_json(writer, req_headers, store.body, store.etag,
+                                  store.body_gzip, head_only)
+            return
+
+        # Content depends only on the version and the query
+        key = f"{store.version}|{since}|{query.get('bbox')}"
+        etag = f'"{store.nonce}-v{store.version}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"'
+        # Either encoding of this content is still current; skip building it
+        for current in (etag, _gzip_etag(etag)):
+            if _etag_matches(req_headers, current):
+                await self._send(writer, '304 Not Modified', {'ETag': current, 'Content-Length': '0'})
+                return
+        if since is not None:
+            body = store.since_body(since, bbox)
+        else:
+            body = store.snapshot_body(bbox)
+        await self._send_json(writer, req_headers, body, etag, head_only=head_only)
+
+    async def _events(self, writer, req_headers, query, bbox):
+        store = self.store
+        headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                   'Connection': 'keep-alive', 'X-Accel-Buffering': 'no'}
+        lines = ['HTTP/1.1 200 OK'] + [f'{k}: {v}' for k, v in headers.items()]
+        lines.append('Access-Control-Allow-Origin: *')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        sub = Subscriber(bbox)
+        store.subscribers.add(sub)
+        try:
+            # Catch up from Last-Event-ID / since=, else start with a full snapshot
+            resume = req_headers.get('last-event-id') or query.get('since')
+            try:
+                resume = int(resume) if resume is not None else None
+            except ValueError:
+                resume = None
+            if resume is not None and store.can_diff_from(resume):
+                if resume < store.version:
+                    self._write_event(writer, 'catchup', store.version, store.since_body(resume, bbox))
+            else:
+                self._write_event(writer, 'snapshot', store.version, store.snapshot_body(bbox))
+            await writer.drain()
+
+            while not sub.lagging:
+                try:
+                    diff = await asyncio.wait_for(sub.queue.get(), SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                    await writer.drain()
+                    continue
+                self._write_event(writer, 'diff', diff.version, diff.payload(sub.bbox))
+                await writer.drain()
+        finally:
+            store.subscribers.discard(sub)
+
+    @staticmethod
+    def _write_event(writer, event, version, body):
+        writer.write(f'event: {event}\nid: {version}\ndata: '.encode() + body + b'\n\n')
+
+    # -- running -----------------------------------------------------------
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Snapshot server listening on http://{host}:{port}")
+        return server
+
+    def publish_threadsafe(self, snapshot):
+        """Publish from another thread (e.g. the stream_ais writer)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.store.publish, snapshot)
+
+    def start_in_thread(self, host, port):
+        """Run the server on its own event loop in a daemon thread"""
+        ready = threading.Event()
+
+        def run():
+            async def main():
+                await self.serve(host, port)
+                ready.set()
+                await asyncio.Event().wait()
+            asyncio.run(main())
+
+        threading.Thread(target=run, name='snapshot-server', daemon=True).start()
+        ready.wait(timeout=10)
+        return self
+
+
+async def watch_file(store, path, poll_s):
+    """Publish the snapshot file whenever it changes on disk"""
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime != last_mtime:
+                with open(path, 'r') as fh:
+                    snapshot = json.load(fh)
+                last_mtime = mtime
+                entered, moved, left = store.publish(snapshot)
+                print(f"Loaded {path} as version {store.version}: "
+                      f"{entered} entered, {moved} moved, {left} left")
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            pass  # caught mid-write; retry on the next poll
+        await asyncio.sleep(poll_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the latest AIS snapshot with ETags, bbox and SSE')
+    parser.add_argument('--host', default=os.environ.get('SNAPSHOT_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SNAPSHOT_PORT', '8080')))
+    parser.add_argument('--file', default='data/ais/latest.json', help='snapshot file to serve')
+    parser.add_argument('--poll', type=float, default=5.0, help='seconds between file checks')
+    args = parser.parse_args()
+
+    async def run():
+        server = SnapshotServer()
+        await server.serve(args.host, args.port)
+        await watch_file(server.store, Path(args.file), args.poll)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Local write-ahead spool for database uploads
+
+Every collection's enriched rows are written to an append-only segment file
+in SPOOL_DIR (compressed NDJSON: zstd when the zstandard package is
+installed, gzip otherwise) and fsynced *before* anything is sent to
+Supabase. A segment is marked committed (renamed to *.committed) only after
+its upload succeeded. Whatever is still pending - a failed upload, a crash
+halfway through the batches, an unreachable database - is replayed on the
+next run, together with the new collection, in one bulk pass.
+
+Replays are safe to repeat: positions are inserted with insert-or-ignore on
+(mmsi, report_time) and collection summaries are upserted on timestamp
+(sql/migrations/010_collection_summary_unique.sql).
+
+Rollups count the distinct collection timestamps in each upload, so a
+replay of several collections adds each of them once. Rows that reached the
+database before a failure are skipped on replay and so are not counted in
+the hourly rollups again; `python rollups.py backfill`
+recomputes those hours exactly.
+
+Segment format: one JSON object per line, {"kind": "summary", ...} for the
+collection summary and {"kind": "row", "row": {...}} per position.
+"""
+
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+SPOOL_DIR = Path(os.environ.get('AIS_SPOOL_DIR', 'data/spool'))
+COMMITTED_SUFFIX = '.committed'
+KEEP_COMMITTED_HOURS = float(os.environ.get('AIS_SPOOL_KEEP_HOURS', '24'))
+# Rows gathered from pending segments before each bulk upload
+REPLAY_CHUNK_ROWS = 50000
+
+_seq = 0
+
+
+def _segment_ext():
+    return '.ndjson.zst' if zstandard else '.ndjson.gz'
+
+
+def _compress(data):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(path, data):
+    if path.name.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f'{path.name} needs the zstandard package')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def write_segment(rows, summary=None, spool_dir=SPOOL_DIR):
+    """Durably write one segment and return its path"""
+    global _seq
+    _seq += 1
+    spool_dir = Path(spool_dir)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+
+    buf = io.StringIO()
+    if summary is not None:
+        buf.write(json.dumps({'kind': 'summary', 'summary': summary}) + '\n')
+    for row in rows:
+        buf.write(json.dumps({'kind': 'row', 'row': row}) + '\n')
+    data = _compress(buf.getvalue().encode('utf-8'))
+
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    path = spool_dir / f'{stamp}-{os.getpid()}-{_seq}{_segment_ext()}'
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+    # Make the rename itself durable
+    try:
+        dir_fd = os.open(spool_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+    return path
+
+
+def pending_segments(spool_dir=SPOOL_DIR):
+    """Uncommitted segments, oldest first"""
+    spool_dir = Path(spool_dir)
+    if not spool_dir.exists():
+        return []
+    return sorted(p for p in spool_dir.iterdir()
+                  if p.name.endswith('.ndjson.zst') or p.name.endswith('.ndjson.gz'))
+
+
+def read_segment(path):
+    """Return (summaries, rows) stored in a segment"""
+    path = Path(path)
+    with open(path, 'rb') as fh:
+        text = _decompress(path, fh.read()).decode('utf-8')
+    summaries, rows = [], []
+    for line in text.splitlines():
+        if not line:
+            continue
+        rec = json.loads(line)
+        if rec.get('kind') == 'summary':
+            summaries.append(rec['summary'])
+        elif rec.get('kind') == 'row':
+            rows.append(rec['row'])
+    return summaries, rows
+
+
+def mark_committed(path):
+    path = Path(path)
+    try:
+        os.replace(path, path.with_name(path.name + COMMITTED_SUFFIX))
+    except FileNotFoundError:
+        pass  # committed by a concurrent replay (collector and stream share the spool)
+
+
+def prune_committed(spool_dir=SPOOL_DIR, keep_hours=KEEP_COMMITTED_HOURS):
+    """Delete committed segments older than keep_hours"""
+    spool_dir = Path(spool_dir)
+    if not spool_dir.exists():
+        return 0
+    cutoff = time.time() - keep_hours * 3600
+    removed = 0
+    for p in spool_dir.glob('*' + COMMITTED_SUFFIX):
+        if p.stat().st_mtime < cutoff:
+            p.unlink()
+            removed += 1
+    return removed
+
+
+def replay_pending(upload, spool_dir=SPOOL_DIR, chunk_rows=REPLAY_CHUNK_ROWS):
+    """Upload every pending segment in bulk and mark them committed
+
+    upload(rows, summaries) does the database writes and must be idempotent.
+    Segments are grouped into chunks of about chunk_rows positions; rows are
+    de-duplicated on (mmsi, report_time) across a chunk before upload. Raises
+    on the first failed chunk, leaving it and later segments pending.
+    Returns the number of rows uploaded.
+    """
+    segments = pending_segments(spool_dir)
+    if not segments:
+        return 0
+    if len(segments) > 1:
+        print(f"Replaying {len(segments)} spooled segments")
+
+    uploaded = 0
+    group, rows, summaries, seen = [], [], [], set()
+
+    def upload_group():
+        nonlocal uploaded
+        upload(rows, summaries)
+        for seg in group:
+            mark_committed(seg)
+        uploaded += len(rows)
+
+    for seg in segments:
+        try:
+            seg_summaries, seg_rows = read_segment(seg)
+        except Exception as e:
+            # Unreadable (e.g. truncated) segment: leave it for inspection
+            print(f"Warning: skipping unreadable spool segment {seg.name}: {e}")
+            continue
+        group.append(seg)
+        summaries.extend(seg_summaries)
+        for row in seg_rows:
+            key = (row.get('mmsi'), row.get('report_time'))
+            if key not in seen:
+                seen.add(key)
+                rows.append(row)
+        if len(rows) >= chunk_rows:
+            upload_group()
+            group, rows, summaries, seen = [], [], [], set()
+
+    if group:
+        upload_group()
+
+    prune_committed(spool_dir)
+    return uploaded
@@ -0,0 +1,27 @@
+-- Anchor-drag alerts emitted by anchor_watch.py
+CREATE TABLE IF NOT EXISTS public.anchor_drag_alerts (
+    id BIGSERIAL PRIMARY KEY,
+    mmsi BIGINT NOT NULL,
+    time TIMESTAMPTZ NOT NULL,
+    anchor_lon DOUBLE PRECISION NOT NULL,
+    anchor_lat DOUBLE PRECISION NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    lat DOUBLE PRECISION NOT NULL,
+    distance_m REAL,
+    swing_radius_m REAL,
+    sog REAL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS anchor_drag_alerts_mmsi_time_idx
+  ON public.anchor_drag_alerts (mmsi, time DESC);
+CREATE INDEX IF NOT EXISTS anchor_drag_alerts_time_idx
+  ON public.anchor_drag_alerts (time DESC);
+
+ALTER TABLE public.anchor_drag_alerts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.anchor_drag_alerts
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.anchor_drag_alerts
+    FOR ALL USING (auth.role() = 'service_role');
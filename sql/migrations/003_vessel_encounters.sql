@@ -0,0 +1,30 @@
+-- Close approaches between vessels, one row per pair per collection (encounters.py)
+CREATE TABLE IF NOT EXISTS public.vessel_encounters (
+    id BIGSERIAL PRIMARY KEY,
+    timestamp TIMESTAMPTZ NOT NULL,
+    mmsi_a BIGINT NOT NULL,
+    mmsi_b BIGINT NOT NULL,
+    distance_m REAL NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    lat DOUBLE PRECISION NOT NULL,
+    sog_a REAL,
+    sog_b REAL,
+    first_seen TIMESTAMPTZ NOT NULL,
+    snapshots INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS vessel_encounters_timestamp_idx
+  ON public.vessel_encounters (timestamp DESC);
+CREATE INDEX IF NOT EXISTS vessel_encounters_mmsi_a_idx
+  ON public.vessel_encounters (mmsi_a, timestamp DESC);
+CREATE INDEX IF NOT EXISTS vessel_encounters_mmsi_b_idx
+  ON public.vessel_encounters (mmsi_b, timestamp DESC);
+
+ALTER TABLE public.vessel_encounters ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.vessel_encounters
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.vessel_encounters
+    FOR ALL USING (auth.role() = 'service_role');
@@ -0,0 +1,38 @@
+-- Hourly rollups of vessel_positions, maintained by collect_ais.py (see rollups.py)
+CREATE TABLE IF NOT EXISTS public.vessel_rollup_hourly (
+    hour TIMESTAMPTZ NOT NULL,
+    dimension TEXT NOT NULL,        -- 'total' | 'territory' | 'ship_type' | 'flag'
+    key TEXT NOT NULL,              -- country code / ship type / MID, '' = none
+    positions BIGINT NOT NULL DEFAULT 0,
+    collections INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, dimension, key)
+);
+
+-- Dashboards read one dimension over a time range
+CREATE INDEX IF NOT EXISTS vessel_rollup_hourly_dimension_hour_idx
+  ON public.vessel_rollup_hourly (dimension, hour DESC);
+
+-- Add one collection's precomputed counts in a single statement.
+-- rollups: [{"hour": ..., "dimension": ..., "key": ..., "positions": n}, ...]
+CREATE OR REPLACE FUNCTION public.apply_vessel_rollups(rollups JSONB)
+RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO public.vessel_rollup_hourly AS r (hour, dimension, key, positions, collections)
+    SELECT (e->>'hour')::timestamptz, e->>'dimension', e->>'key', (e->>'positions')::bigint, 1
+    FROM jsonb_array_elements(rollups) AS e
+    ON CONFLICT (hour, dimension, key) DO UPDATE
+        SET positions = r.positions + EXCLUDED.positions,
+            collections = r.collections + EXCLUDED.collections;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_vessel_rollups(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_vessel_rollups(JSONB) TO service_role;
+
+ALTER TABLE public.vessel_rollup_hourly ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.vessel_rollup_hourly
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.vessel_rollup_hourly
+    FOR ALL USING (auth.role() = 'service_role');
@@ -0,0 +1,52 @@
+-- Cheap database statistics for check_database.py
+
+-- HyperLogLog sketch of distinct MMSIs, updated by collect_ais.py (see mmsi_sketch.py)
+CREATE TABLE IF NOT EXISTS public.mmsi_sketch (
+    name TEXT PRIMARY KEY,
+    precision SMALLINT NOT NULL,
+    registers TEXT NOT NULL,          -- base64 of 2^precision byte registers
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ALTER TABLE public.mmsi_sketch ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.mmsi_sketch
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.mmsi_sketch
+    FOR ALL USING (auth.role() = 'service_role');
+
+-- Constant-time statistics: planner estimates, relation sizes and the
+-- timestamp range read from the ends of idx_vessel_timestamp
+CREATE OR REPLACE FUNCTION public.vessel_db_stats()
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public, pg_catalog
+AS $$
+    SELECT jsonb_build_object(
+        'estimated_rows', (SELECT reltuples::bigint FROM pg_class
+                           WHERE oid = 'public.vessel_positions'::regclass),
+        'table_bytes', pg_table_size('public.vessel_positions'),
+        'index_bytes', pg_indexes_size('public.vessel_positions'),
+        'total_bytes', pg_total_relation_size('public.vessel_positions'),
+        'last_analyze', (SELECT greatest(last_analyze, last_autoanalyze) FROM pg_stat_user_tables
+                         WHERE relid = 'public.vessel_positions'::regclass),
+        'oldest', (SELECT timestamp FROM public.vessel_positions ORDER BY timestamp ASC LIMIT 1),
+        'newest', (SELECT timestamp FROM public.vessel_positions ORDER BY timestamp DESC LIMIT 1)
+    );
+$$;
+
+-- Exact counts; scans the whole table, for check_database.py --exact only
+CREATE OR REPLACE FUNCTION public.vessel_db_stats_exact()
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object('rows', count(*), 'unique_mmsi', count(DISTINCT mmsi))
+    FROM public.vessel_positions;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.vessel_db_stats_exact() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.vessel_db_stats_exact() TO service_role;
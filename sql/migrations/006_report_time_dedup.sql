@@ -0,0 +1,10 @@
+-- Store the vessel's own report time and reject repeats of the same fix.
+-- `timestamp` stays the collection time; report_time comes from the
+-- Digitraffic timestampExternal property. Older rows keep report_time NULL,
+-- which never conflicts.
+ALTER TABLE public.vessel_positions
+  ADD COLUMN IF NOT EXISTS report_time TIMESTAMPTZ;
+
+-- Conflict target for collect_ais.py's insert-or-ignore upsert
+CREATE UNIQUE INDEX IF NOT EXISTS vessel_positions_mmsi_report_time_key
+  ON public.vessel_positions (mmsi, report_time);
@@ -0,0 +1,29 @@
+-- Downsampled history written by track_retention.py once raw positions
+-- age out of full resolution
+CREATE TABLE IF NOT EXISTS public.vessel_tracks_summary (
+    id BIGSERIAL PRIMARY KEY,
+    mmsi BIGINT NOT NULL,
+    time TIMESTAMPTZ NOT NULL,        -- report time (collection time for old rows)
+    longitude DOUBLE PRECISION NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    sog REAL,
+    cog REAL,
+    heading INTEGER,
+    nav_stat INTEGER,
+    ship_type INTEGER,
+    territorial_water_country_code CHAR(2),
+    reason SMALLINT NOT NULL          -- bitmask: 1 interval, 2 endpoint, 4 boundary, 8 turn
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS vessel_tracks_summary_mmsi_time_key
+  ON public.vessel_tracks_summary (mmsi, time);
+CREATE INDEX IF NOT EXISTS vessel_tracks_summary_time_idx
+  ON public.vessel_tracks_summary (time DESC);
+
+ALTER TABLE public.vessel_tracks_summary ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.vessel_tracks_summary
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.vessel_tracks_summary
+    FOR ALL USING (auth.role() = 'service_role');
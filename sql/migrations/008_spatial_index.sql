@@ -0,0 +1,20 @@
+-- Spatial and time indexes for historical box queries (see position_query.py)
+
+CREATE EXTENSION IF NOT EXISTS postgis WITH SCHEMA extensions;
+
+-- Point geometry in WGS84, written by collect_ais.py / stream_ais.py as EWKT
+ALTER TABLE public.vessel_positions
+  ADD COLUMN IF NOT EXISTS geom extensions.geometry(Point, 4326);
+
+-- Existing rows (one-off; large tables may want to run this in id ranges)
+UPDATE public.vessel_positions
+  SET geom = extensions.ST_SetSRID(extensions.ST_MakePoint(longitude, latitude), 4326)
+  WHERE geom IS NULL;
+
+CREATE INDEX IF NOT EXISTS vessel_positions_geom_idx
+  ON public.vessel_positions USING GIST (geom);
+
+-- Rows arrive in time order, so a BRIN index narrows time ranges for a
+-- fraction of the B-tree's size
+CREATE INDEX IF NOT EXISTS vessel_positions_timestamp_brin_idx
+  ON public.vessel_positions USING BRIN (timestamp) WITH (pages_per_range = 32);
@@ -0,0 +1,27 @@
+-- Port arrival/departure events from port_calls.py
+CREATE TABLE IF NOT EXISTS public.port_calls (
+    id BIGSERIAL PRIMARY KEY,
+    mmsi BIGINT NOT NULL,
+    port_id TEXT NOT NULL,            -- id in ports.geojson
+    locode CHAR(5),
+    port_name TEXT,
+    event TEXT NOT NULL CHECK (event IN ('arrival', 'departure')),
+    time TIMESTAMPTZ NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    lat DOUBLE PRECISION NOT NULL,
+    duration_s INTEGER,               -- length of the call, on departures
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS port_calls_port_time_idx
+  ON public.port_calls (port_id, time DESC);
+CREATE INDEX IF NOT EXISTS port_calls_mmsi_time_idx
+  ON public.port_calls (mmsi, time DESC);
+
+ALTER TABLE public.port_calls ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.port_calls
+    FOR SELECT USING (true);
+
+CREATE POLICY "Allow service role full access" ON public.port_calls
+    FOR ALL USING (auth.role() = 'service_role');
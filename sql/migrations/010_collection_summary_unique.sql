@@ -0,0 +1,3 @@
+-- One summary per collection, so spool replays (spool.py) can upsert it
+CREATE UNIQUE INDEX IF NOT EXISTS collection_summary_timestamp_key
+  ON public.collection_summary (timestamp);
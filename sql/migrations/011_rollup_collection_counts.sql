@@ -0,0 +1,19 @@
+-- apply_vessel_rollups() takes the number of collections behind each count.
+-- A spool replay (spool.py) uploads several collections in one call, so a
+-- fixed 1 per call undercounted them.
+-- rollups: [{"hour": ..., "dimension": ..., "key": ..., "positions": n, "collections": c}, ...]
+CREATE OR REPLACE FUNCTION public.apply_vessel_rollups(rollups JSONB)
+RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO public.vessel_rollup_hourly AS r (hour, dimension, key, positions, collections)
+    SELECT (e->>'hour')::timestamptz, e->>'dimension', e->>'key', (e->>'positions')::bigint,
+           COALESCE((e->>'collections')::integer, 1)
+    FROM jsonb_array_elements(rollups) AS e
+    ON CONFLICT (hour, dimension, key) DO UPDATE
+        SET positions = r.positions + EXCLUDED.positions,
+            collections = r.collections + EXCLUDED.collections;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_vessel_rollups(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_vessel_rollups(JSONB) TO service_role;
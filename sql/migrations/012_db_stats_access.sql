@@ -0,0 +1,21 @@
+-- vessel_db_stats() is SECURITY DEFINER: like vessel_db_stats_exact(), only
+-- the service role (check_database.py) may call it
+REVOKE EXECUTE ON FUNCTION public.vessel_db_stats() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.vessel_db_stats() TO service_role;
+
+-- Every MMSI stored so far, raw or downsampled, for seeding the sketch
+-- (check_database.py --seed-sketch). Returned as one JSONB array so the
+-- PostgREST row limit does not apply. Scans both tables.
+CREATE OR REPLACE FUNCTION public.vessel_distinct_mmsi()
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_agg(mmsi), '[]'::jsonb)
+    FROM (SELECT mmsi FROM public.vessel_positions
+          UNION
+          SELECT mmsi FROM public.vessel_tracks_summary) AS m;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.vessel_distinct_mmsi() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.vessel_distinct_mmsi() TO service_role;
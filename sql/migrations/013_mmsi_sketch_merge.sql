@@ -0,0 +1,53 @@
+-- Merge a partial MMSI sketch into the stored one on the server.
+-- update_mmsi_sketch() used to read the whole 16 KB sketch, fold in its
+-- MMSIs and upsert it back, so two concurrent writers (collector, stream
+-- ingest, --seed-sketch) could overwrite each other's registers. The client
+-- now sends only the sketch of its own MMSIs; the register-wise max is taken
+-- here with the row locked. Returns the merged registers (base64).
+CREATE OR REPLACE FUNCTION public.merge_mmsi_sketch(p_name TEXT, p_precision SMALLINT, p_registers TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    incoming BYTEA := decode(p_registers, 'base64');
+    stored_precision SMALLINT;
+    stored BYTEA;
+    merged TEXT;
+BEGIN
+    IF length(incoming) <> (1 << p_precision) THEN
+        RAISE EXCEPTION 'sketch has % registers, precision % needs %',
+            length(incoming), p_precision, 1 << p_precision;
+    END IF;
+
+    INSERT INTO public.mmsi_sketch (name, precision, registers, updated_at)
+    VALUES (p_name, p_precision, p_registers, NOW())
+    ON CONFLICT (name) DO NOTHING;
+    IF FOUND THEN
+        RETURN p_registers;
+    END IF;
+
+    SELECT precision, decode(registers, 'base64') INTO stored_precision, stored
+    FROM public.mmsi_sketch
+    WHERE name = p_name
+    FOR UPDATE;
+
+    IF stored_precision <> p_precision THEN
+        RAISE EXCEPTION 'cannot merge sketches of different precision (% and %)',
+            stored_precision, p_precision;
+    END IF;
+
+    SELECT replace(encode(decode(string_agg(
+               lpad(to_hex(greatest(get_byte(stored, i), get_byte(incoming, i))), 2, '0'),
+               '' ORDER BY i), 'hex'), 'base64'), E'\n', '')
+    INTO merged
+    FROM generate_series(0, length(incoming) - 1) AS i;
+
+    UPDATE public.mmsi_sketch
+    SET registers = merged, updated_at = NOW()
+    WHERE name = p_name;
+    RETURN merged;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.merge_mmsi_sketch(TEXT, SMALLINT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.merge_mmsi_sketch(TEXT, SMALLINT, TEXT) TO service_role;
@@ -0,0 +1,11 @@
+-- Spatial index on the downsampled history, so position_query.py can answer
+-- box queries that reach back past the raw-position retention window
+
+-- Generated from longitude/latitude: track_retention.py's INSERT ... SELECT
+-- needs no change and no row can miss its point
+ALTER TABLE public.vessel_tracks_summary
+  ADD COLUMN IF NOT EXISTS geom extensions.geometry(Point, 4326)
+  GENERATED ALWAYS AS (extensions.ST_SetSRID(extensions.ST_MakePoint(longitude, latitude), 4326)) STORED;
+
+CREATE INDEX IF NOT EXISTS vessel_tracks_summary_geom_idx
+  ON public.vessel_tracks_summary USING GIST (geom);
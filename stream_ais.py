@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Streaming AIS ingest from the Digitraffic MQTT feed
+
+Instead of polling /api/ais/v1/locations once an hour, subscribe to the
+Digitraffic AIS topics and store every fix as it arrives:
+
+  vessels-v2/<mmsi>/location   position reports
+  vessels-v2/<mmsi>/metadata   name, type, destination, ETA, draught
+
+Each location message is filtered against the collection regions, tagged
+with its territorial country and turned into the same vessel_positions row
+collect_ais.py builds. Rows are flushed to Supabase in micro-batches when
+STREAM_BATCH_SIZE rows are waiting or the oldest is STREAM_BATCH_AGE_S old.
+All rows of a micro-batch share one `timestamp` (report_time keeps each fix's
+own time). Micro-batches have no collection_summary row, so the hourly
+rollups count streamed positions under their own stream_ dimensions instead
+of as collections (see rollups.py). Rollups and the MMSI sketch are folded
+every STREAM_AGGREGATE_S seconds and on shutdown, not on every flush.
+
+Messages pass through a bounded queue; when the writer falls behind, the MQTT
+network thread blocks on it instead of the process growing without bound.
+A long stall also stalls MQTT keepalives and can drop the connection, so the
+client subscribes with QoS 1 on a persistent session (stable client id
+AIS_MQTT_CLIENT_ID): unacknowledged messages are redelivered after the
+reconnect. If the broker only grants QoS 0, that is reported at startup, and
+messages sent while disconnected are lost; disconnects are counted in the
+final stats.
+
+Stationary vessels are fed to an in-process anchor_watch.AnchorWatch, whose
+state is saved on every flush.
+
+With --serve PORT the latest position of every moving vessel seen in the last
+STREAM_SNAPSHOT_AGE_S is also served by snapshot_server.py from this process,
+published after each micro-batch.
+
+Usage:
+  python stream_ais.py                                # live Digitraffic feed
+  python stream_ais.py --host localhost --port 1883 --transport tcp --no-tls
+                                                      # local Mosquitto
+  python stream_ais.py --record messages.ndjson       # also record raw messages
+  python stream_ais.py --replay messages.ndjson [--speed 10]
+                                                      # replay a recording, no broker
+  python stream_ais.py --serve 8080                   # also serve the live snapshot
+
+Requires paho-mqtt for live mode: pip install paho-mqtt
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import paho.mqtt.client as mqtt
+except Exception:
+    mqtt = None
+
+import anchor_watch
+import spool
+from collect_ais import (BBOX, build_vessel_row, get_supabase_client, is_moving,
+                         save_anchor_alerts, snapshot_vessel, update_aggregates,
+                         upload_spooled)
+from regions import load_regions
+from snapshot_server import SnapshotServer
+
+MQTT_HOST = os.environ.get('AIS_MQTT_HOST', 'meri.digitraffic.fi')
+MQTT_PORT = int(os.environ.get('AIS_MQTT_PORT', '443'))
+MQTT_TRANSPORT = os.environ.get('AIS_MQTT_TRANSPORT', 'websockets')
+MQTT_PATH = os.environ.get('AIS_MQTT_PATH', '/mqtt')
+MQTT_TOPICS = ['vessels-v2/+/location', 'vessels-v2/+/metadata']
+MQTT_QOS = 1
+# Persistent sessions are keyed by client id, so it must survive restarts
+MQTT_CLIENT_ID = os.environ.get('AIS_MQTT_CLIENT_ID', f'ais-stream-{socket.gethostname()}')
+
+BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '1000'))
+BATCH_AGE_S = float(os.environ.get('STREAM_BATCH_AGE_S', '10'))
+QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '20000'))
+# Rollups and the MMSI sketch are updated this often rather than per flush
+AGGREGATE_S = float(os.environ.get('STREAM_AGGREGATE_S', '300'))
+# Vessels not heard from for this long drop out of the served snapshot
+SNAPSHOT_AGE_S = float(os.environ.get('STREAM_SNAPSHOT_AGE_S', '900'))
+
+# Metadata messages use the same field names as the REST vessels endpoint
+# except for the ship type
+_METADATA_FIELDS = {'name': 'name', 'type': 'ship_type', 'destination': 'destination',
+                    'eta': 'eta', 'draught': 'draught'}
+
+
+def parse_topic(topic):
+    """Return (mmsi, kind) for vessels-v2/<mmsi>/<kind>, or (None, None)"""
+    parts = topic.split('/')
+    if len(parts) != 3 or parts[0] != 'vessels-v2':
+        return None, None
+    try:
+        return int(parts[1]), parts[2]
+    except ValueError:
+        return None, None
+
+
+def location_feature(mmsi, msg):
+    """Shape a location message like a feature of the REST locations endpoint"""
+    return {
+        'geometry': {'coordinates': [msg['lon'], msg['lat']]},
+        'properties': {
+            'mmsi': mmsi,
+            'sog': msg.get('sog'),
+            'cog': msg.get('cog'),
+            'navStat': msg.get('navStat'),
+            'heading': msg.get('heading'),
+            'posAcc': msg.get('posAcc'),
+            # location messages carry epoch seconds, REST uses milliseconds
+            'timestampExternal': msg['time'] * 1000 if msg.get('time') else None
+        }
+    }
+
+
+class StreamIngest:
+    """Turns raw MQTT messages into vessel_positions rows and flushes them in micro-batches"""
+
+    def __init__(self, regions, batch_size=BATCH_SIZE, batch_age_s=BATCH_AGE_S,
+                 queue_size=QUEUE_SIZE, record_file=None, server=None,
+                 aggregate_s=AGGREGATE_S):
+        self.regions = regions
+        self.batch_size = batch_size
+        self.batch_age_s = batch_age_s
+        self.aggregate_s = aggregate_s
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.metadata = {}
+        self.anchors = anchor_watch.AnchorWatch.load()
+        self.supabase = get_supabase_client()
+        self.record_file = record_file
+        self.pending_alerts = []
+        self.server = server
+        self.latest = {}    # mmsi -> (latest.json entry, time seen), for the server
+        # Uploaded rows (and collection timestamps of replayed collector
+        # segments) not yet folded into the rollups and sketch
+        self.unfolded_rows = []
+        self.unfolded_times = []
+        self.last_fold = time.monotonic()
+        self.stop_event = threading.Event()
+        self.stats = {'received': 0, 'out_of_region': 0, 'flushed': 0, 'blocked': 0,
+                      'disconnects': 0}
+
+    # -- producer side (MQTT network thread or replay loop) ----------------
+
+    def submit(self, topic, payload):
+        """Queue one raw message; blocks while the queue is full (backpressure)"""
+        if self.record_file:
+            self.record_file.write(json.dumps({'t': time.time(), 'topic': topic,
+                                               'payload': payload}) + '\n')
+        try:
+            self.queue.put_nowait((topic, payload))
+        except queue.Full:
+            self.stats['blocked'] += 1
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put((topic, payload), timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+    # -- consumer side (writer thread) -------------------------------------
+
+    def handle(self, topic, payload):
+        """Process one message. Returns a vessel_positions row or None."""
+        mmsi, kind = parse_topic(topic)
+        if mmsi is None:
+            return None
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return None
+
+        if kind == 'metadata':
+            meta = self.metadata.setdefault(mmsi, {})
+            for src, dst in _METADATA_FIELDS.items():
+                if src in msg:
+                    value = msg[src]
+                    meta[dst] = value.strip() if isinstance(value, str) else value
+            return None
+
+        if kind != 'location' or msg.get('lon') is None or msg.get('lat') is None:
+            return None
+
+        self.stats['received'] += 1
+        lon, lat = msg['lon'], msg['lat']
+        if not any(r.contains(lon, lat) for r in self.regions):
+            self.stats['out_of_region'] += 1
+            return None
+
+        feature = location_feature(mmsi, msg)
+        now = time.time()
+        alert = self.anchors.update(mmsi, lon, lat, msg.get('sog'), msg.get('navStat'),
+                                    msg.get('time') or now)
+        if alert:
+            print(f"Anchor drag: {alert['mmsi']} {alert['distance_m']} m from anchor")
+            self.pending_alerts.append(alert)
+
+        if not is_moving(feature):
+            return None
+        timestamp_str = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        row = build_vessel_row(feature, self.metadata.get(mmsi, {}), timestamp_str)
+        if self.server:
+            self.latest[mmsi] = (snapshot_vessel(row), now)
+        return row
+
+    def flush(self, rows, final=False):
+        """Write one micro-batch and the side outputs that go with it"""
+        # One timestamp per micro-batch, without a collection_summary row: the
+        # rollups count these rows as streamed. The same report can arrive
+        # twice (redelivery after a reconnect, replays).
+        batch_time = datetime.now(timezone.utc).isoformat()
+        unique = {}
+        for row in rows:
+            row['timestamp'] = batch_time
+            unique[(row['mmsi'], row['report_time'])] = row
+        rows = list(unique.values())
+
+        if rows and self.supabase:
+            # Spool first; a failed upload is retried with the next flush
+            spool.write_segment(rows)
+            try:
+                spool.replay_pending(self._upload)
+                self.stats['flushed'] += len(rows)
+            except Exception as e:
+                print(f"Error saving micro-batch of {len(rows)} rows (kept in spool): {e}")
+        elif rows:
+            print(f"Skipping database save of {len(rows)} rows - Supabase not available")
+
+        if self.supabase and (final or time.monotonic() - self.last_fold >= self.aggregate_s):
+            self.fold_aggregates()
+
+        if self.pending_alerts:
+            save_anchor_alerts(self.pending_alerts)
+            self.pending_alerts = []
+        self.anchors.save()
+
+        if self.server:
+            self.publish_snapshot()
+
+    def _upload(self, rows, summaries):
+        # The spool is shared with collect_ais.py, so a replay can include
+        # collector segments; their summaries mark those rows as collected
+        inserted = upload_spooled(self.supabase, rows, summaries, aggregate=False)
+        self.unfolded_rows.extend(inserted)
+        self.unfolded_times.extend(summary['timestamp'] for summary in summaries)
+
+    def fold_aggregates(self):
+        """Add the rows uploaded since the last fold to the rollups and sketch"""
+        self.last_fold = time.monotonic()
+        if self.unfolded_rows:
+            update_aggregates(self.supabase, self.unfolded_rows, self.unfolded_times)
+        self.unfolded_rows = []
+        self.unfolded_times = []
+
+    def publish_snapshot(self):
+        """Hand the current fleet to the snapshot server"""
+        now = time.time()
+        cutoff = now - SNAPSHOT_AGE_S
+        for mmsi in [m for m, (_, seen) in self.latest.items() if seen < cutoff]:
+            del self.latest[mmsi]
+        self.server.publish_threadsafe({
+            'timestamp': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            'vessels': [vessel for vessel, _ in self.latest.values()]
+        })
+
+    def run_writer(self):
+        """Drain the queue, flushing by batch size or age, until stopped"""
+        batch = []
+        batch_started = None
+        while True:
+            # Wake at least once a second to notice stop()
+            timeout = min(self.batch_age_s, 1.0)
+            if batch_started is not None:
+                timeout = min(timeout, max(0.0, batch_started + self.batch_age_s - time.monotonic()))
+            try:
+                topic, payload = self.queue.get(timeout=timeout)
+                row = self.handle(topic, payload)
+                if row is not None:
+                    if not batch:
+                        batch_started = time.monotonic()
+                    batch.append(row)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    break
+
+            if batch and (len(batch) >= self.batch_size
+                          or time.monotonic() - batch_started >= self.batch_age_s):
+                self.flush(batch)
+                batch = []
+                batch_started = None
+
+        self.flush(batch, final=True)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def run_live(ingest, args):
+    if mqtt is None:
+        print("Error: paho-mqtt not installed. Install with: pip install paho-mqtt")
+        return
+
+    client_id = args.client_id
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                             clean_session=False, transport=args.transport)
+    except AttributeError:
+        # paho-mqtt < 2.0
+        client = mqtt.Client(client_id=client_id, clean_session=False, transport=args.transport)
+    if args.transport == 'websockets':
+        client.ws_set_options(path=args.path)
+    if args.tls:
+        client.tls_set()
+
+    def on_connect(client, userdata, flags, reason_code, properties=None):
+        print(f"Connected to {args.host}:{args.port} ({reason_code})")
+        client.subscribe([(topic, MQTT_QOS) for topic in MQTT_TOPICS])
+
+    def on_subscribe(client, userdata, mid, granted, properties=None):
+        # paho 2.x passes ReasonCode objects, 1.x plain ints
+        granted = [getattr(g, 'value', g) for g in granted]
+        if any(g < MQTT_QOS for g in granted):
+            print(f"Warning: broker granted QoS {granted}; messages sent while "
+                  f"disconnected (e.g. after a long backpressure stall) are lost")
+
+    def on_disconnect(client, userdata, *args):
+        ingest.stats['disconnects'] += 1
+        print("Disconnected from broker, reconnecting")
+
+    def on_message(client, userdata, message):
+        # QoS 1 messages are acknowledged when this returns
+        ingest.submit(message.topic, message.payload.decode('utf-8', 'replace'))
+
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    client.connect(args.host, args.port, keepalive=60)
+    client.loop_start()
+    try:
+        ingest.stop_event.wait()
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def run_replay(ingest, path, speed):
+    """Feed recorded messages; speed 0 = as fast as the writer accepts them"""
+    print(f"Replaying {path} (speed {speed or 'max'})")
+    first_t = None
+    started = time.monotonic()
+    with open(path, 'r') as fh:
+        for line in fh:
+            if ingest.stop_event.is_set():
+                break
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if speed and rec.get('t'):
+                if first_t is None:
+                    first_t = rec['t']
+                delay = (rec['t'] - first_t) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            payload = rec['payload']
+            if not isinstance(payload, str):
+                payload = json.dumps(payload)
+            ingest.submit(rec['topic'], payload)
+    ingest.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream AIS positions from the Digitraffic MQTT feed')
+    parser.add_argument('--host', default=MQTT_HOST)
+    parser.add_argument('--port', type=int, default=MQTT_PORT)
+    parser.add_argument('--transport', choices=['websockets', 'tcp'], default=MQTT_TRANSPORT)
+    parser.add_argument('--path', default=MQTT_PATH, help='websocket path')
+    parser.add_argument('--no-tls', dest='tls', action='store_false')
+    parser.add_argument('--client-id', default=MQTT_CLIENT_ID,
+                        help='MQTT client id (keys the persistent session)')
+    parser.add_argument('--record', help='append raw messages to this NDJSON file')
+    parser.add_argument('--replay', help='replay an NDJSON recording instead of connecting')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay speed multiplier (0 = as fast as possible)')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='serve the live snapshot over HTTP/SSE on this port')
+    parser.add_argument('--serve-host', default='0.0.0.0')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("AIS Streaming Ingest Started")
+    print("=" * 60)
+
+    regions = load_regions(BBOX)
+    record_file = open(args.record, 'a', buffering=1) if args.record else None
+    server = SnapshotServer().start_in_thread(args.serve_host, args.serve) if args.serve else None
+    ingest = StreamIngest(regions, record_file=record_file, server=server)
+
+    signal.signal(signal.SIGINT, lambda *_: ingest.stop())
+    signal.signal(signal.SIGTERM, lambda *_: ingest.stop())
+
+    writer = threading.Thread(target=ingest.run_writer, name='ais-writer')
+    writer.start()
+    try:
+        if args.replay:
+            run_replay(ingest, args.replay, args.speed)
+        else:
+            run_live(ingest, args)
+    finally:
+        ingest.stop()
+        writer.join()
+        if record_file:
+            record_file.close()
+
+    s = ingest.stats
+    print(f"Received {s['received']} positions: {s['out_of_region']} outside regions, "
+          f"{s['flushed']} uploaded; "
+          f"producer blocked {s['blocked']} times, {s['disconnects']} disconnects")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""In-memory stand-in for the Supabase client used by the collector tests"""
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.payload = None
+        self.result = None
+
+    def upsert(self, payload, **kwargs):
+        self.payload = payload
+        return self
+
+    insert = upsert
+
+    def __getattr__(self, attr):
+        # select / eq / limit / ...: chainable no-ops
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        if self.client.fail:
+            raise ConnectionError('database unreachable')
+        self.client.calls.append((self.name, self.payload))
+        if self.result is not None:
+            return FakeResponse(self.result)
+        if self.payload is None:
+            return FakeResponse([])
+        return FakeResponse(self.payload if isinstance(self.payload, list) else [self.payload])
+
+
+class FakeSupabase:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        query = FakeQuery(self, name)
+        query.payload = params
+        if name == 'merge_mmsi_sketch':
+            # No stored sketch yet: the merge is the partial sketch itself
+            query.result = params['p_registers']
+        return query
@@ -0,0 +1,112 @@
+"""AnchorWatch: settling, drag alerts, re-anchoring and state files"""
+
+import math
+
+import anchor_watch
+from anchor_watch import AnchorWatch
+
+MMSI = 230000001
+LON, LAT = 24.80, 60.05
+HOUR = 3600.0
+
+
+def _offset(metres_east, metres_north=0.0):
+    """lon/lat of a point the given distance from the start position"""
+    m_per_deg = math.pi * anchor_watch.EARTH_RADIUS_M / 180.0
+    return (LON + metres_east / (m_per_deg * math.cos(math.radians(LAT))),
+            LAT + metres_north / m_per_deg)
+
+
+class Feeder:
+    """Feeds hourly fixes for one vessel"""
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.t = 1765000000.0
+
+    def fix(self, east, north=0.0, sog=0.2, nav_stat=1):
+        self.t += HOUR
+        lon, lat = _offset(east, north)
+        return self.watch.update(MMSI, lon, lat, sog, nav_stat, self.t)
+
+
+def _settle(feed, east=0.0):
+    for dx in (0, 20, -20):
+        assert feed.fix(east + dx) is None
+
+
+def test_settles_after_min_fixes():
+    watch = AnchorWatch()
+    feed = Feeder(watch)
+    feed.fix(0)
+    feed.fix(20)
+    assert watch.anchored_count() == 0
+    feed.fix(-20)
+    assert watch.anchored_count() == 1
+
+
+def test_drag_raises_one_alert():
+    feed = Feeder(AnchorWatch())
+    _settle(feed)
+    assert feed.fix(600, sog=1.5) is None          # first fix outside: not confirmed yet
+    alert = feed.fix(900, sog=1.5)
+    assert alert is not None
+    assert alert['mmsi'] == MMSI
+    assert 850 < alert['distance_m'] < 950
+    assert abs(alert['anchor_lon'] - LON) < 1e-4
+    assert feed.fix(1500, sog=1.5) is None          # still dragging: no repeat
+
+
+def test_reanchor_then_second_drag_alerts_again():
+    watch = AnchorWatch()
+    feed = Feeder(watch)
+    _settle(feed)
+
+    # Drag ~1.3 km and stay there
+    assert feed.fix(1300) is None
+    assert feed.fix(1310) is not None
+    assert feed.fix(1290) is None                   # settled: circle re-seeded here
+    assert watch.anchored_count() == 1
+    assert feed.fix(1300) is None                   # inside the new circle
+
+    # Second drag, 3 km from the new anchor
+    assert feed.fix(4300, sog=1.5) is None
+    alert = feed.fix(4300, sog=1.5)
+    assert alert is not None
+    assert 2900 < alert['distance_m'] < 3100
+    new_anchor_lon, _ = _offset(1300)
+    assert abs(alert['anchor_lon'] - new_anchor_lon) < 1e-4
+
+
+def test_weighing_anchor_resets():
+    watch = AnchorWatch()
+    feed = Feeder(watch)
+    _settle(feed)
+    assert feed.fix(2000, sog=10, nav_stat=0) is None
+    assert watch.anchored_count() == 0
+
+
+def test_state_round_trip(tmp_path):
+    path = tmp_path / 'anchor_state.bin'
+    watch = AnchorWatch()
+    feed = Feeder(watch)
+    _settle(feed)
+    watch.save(path)
+
+    restored = AnchorWatch.load(path)
+    assert restored.anchored_count() == 1
+    feed.watch = restored
+    feed.fix(600, sog=1.5)
+    assert feed.fix(900, sog=1.5) is not None
+
+
+def test_unreadable_state_starts_fresh(tmp_path):
+    path = tmp_path / 'anchor_state.bin'
+    path.write_bytes(b'\x80\x05not a state file')
+    assert AnchorWatch.load(path).slots == {}
+
+    watch = AnchorWatch()
+    _settle(Feeder(watch))
+    watch.save(path)
+    path.write_bytes(path.read_bytes()[:-10])       # truncated
+    assert AnchorWatch.load(path).slots == {}
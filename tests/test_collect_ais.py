@@ -0,0 +1,92 @@
+"""Smoke tests for collect_ais.main() with the network fetches mocked out"""
+
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+import collect_ais
+from fakes import FakeSupabase
+
+REPO = Path(__file__).resolve().parent.parent
+NOW_MS = 1765000000000
+
+
+def _feature(mmsi, lon, lat, sog, nav_stat=0):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': {'mmsi': mmsi, 'sog': sog, 'cog': 90.0, 'navStat': nav_stat,
+                       'heading': 90, 'posAcc': True, 'timestampExternal': NOW_MS}
+    }
+
+
+FEATURES = [
+    _feature(230000001, 24.90, 60.10, 8.0),
+    _feature(230000002, 24.9005, 60.1005, 7.5),   # close to the first: an encounter
+    _feature(230000003, 22.00, 59.80, 12.0),
+    _feature(230000004, 24.95, 60.16, 0.0, nav_stat=5),
+    _feature(219000001, 10.00, 55.00, 10.0),      # outside the collection box
+]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in a scratch directory holding the reference data main() reads"""
+    for name in ('territorial_waters_baltic.geojson', 'ports.geojson'):
+        shutil.copy(REPO / name, tmp_path / name)
+    (tmp_path / 'data' / 'ais').mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collect_ais, 'MAX_WORKERS', 1)
+    monkeypatch.setattr(collect_ais, 'fetch_ais_data',
+                        lambda: {'type': 'FeatureCollection', 'features': FEATURES})
+    monkeypatch.setattr(collect_ais, 'fetch_vessel_metadata',
+                        lambda mmsi_list: {m: {'name': f'V{m}', 'ship_type': 70,
+                                               'destination': 'HELSINKI', 'eta': None,
+                                               'draught': 50} for m in mmsi_list})
+    return tmp_path
+
+
+def _use_client(monkeypatch, client):
+    monkeypatch.setattr(collect_ais, 'get_supabase_client', lambda: client)
+
+
+def test_main_exports_and_saves(workdir, monkeypatch):
+    client = FakeSupabase()
+    _use_client(monkeypatch, client)
+
+    collect_ais.main()
+
+    latest = json.loads((workdir / 'data/ais/latest.json').read_text())
+    assert sorted(v['mmsi'] for v in latest['vessels']) == [230000001, 230000002, 230000003]
+    assert latest['encounter_count'] == 1
+    assert (workdir / 'data/ais/anchor_alerts.json').exists()
+
+    tables = {name for name, _ in client.calls}
+    assert {'vessel_positions', 'collection_summary', 'vessel_encounters',
+            'merge_mmsi_sketch'} <= tables
+    assert collect_ais.spool.pending_segments() == []
+    rollups = next(p for name, p in client.calls if name == 'apply_vessel_rollups')['rollups']
+    assert [(r['positions'], r['collections']) for r in rollups
+            if r['dimension'] == 'total'] == [(3, 1)]
+
+
+def test_main_without_supabase(workdir, monkeypatch):
+    _use_client(monkeypatch, None)
+
+    collect_ais.main()
+
+    assert (workdir / 'data/ais/latest.json').exists()
+
+
+def test_main_database_outage_exports_then_fails(workdir, monkeypatch):
+    _use_client(monkeypatch, FakeSupabase(fail=True))
+
+    with pytest.raises(SystemExit) as exc:
+        collect_ais.main()
+
+    assert exc.value.code == 1
+    assert (workdir / 'data/ais/latest.json').exists()
+    assert (workdir / 'data/ais/anchor_alerts.json').exists()
+    assert len(collect_ais.spool.pending_segments()) == 1
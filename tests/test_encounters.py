@@ -0,0 +1,65 @@
+"""find_close_pairs() grid search against an all-pairs comparison"""
+
+import math
+import random
+
+import pytest
+
+import encounters
+from encounters import find_close_pairs
+
+MAX_M = 200.0
+
+
+def _brute_force(points, max_distance_m):
+    pairs = {}
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            d = encounters.distance_m(*points[i], *points[j])
+            if d <= max_distance_m:
+                pairs[(i, j)] = d
+    return pairs
+
+
+def _grid(points, max_distance_m):
+    return {(min(i, j), max(i, j)): d for i, j, d in find_close_pairs(points, max_distance_m)}
+
+
+def _edge_points(rng, max_lat, n):
+    """Points within a few metres of the grid lines find_close_pairs will use"""
+    cell_lat = MAX_M / encounters._M_PER_DEG
+    cell_lon = MAX_M / (encounters._M_PER_DEG * math.cos(math.radians(max_lat)))
+    jitter = 5.0 / encounters._M_PER_DEG
+    points = []
+    for _ in range(n):
+        lon = round(rng.uniform(20.0, 20.3) / cell_lon) * cell_lon
+        lat = round(rng.uniform(max_lat - 0.5, max_lat) / cell_lat) * cell_lat
+        points.append((lon + rng.uniform(-jitter, jitter), lat + rng.uniform(-jitter, jitter)))
+    return points
+
+
+@pytest.mark.parametrize('max_lat', [66.0, 80.0])
+def test_grid_matches_brute_force(max_lat):
+    rng = random.Random(28)
+    points = [(rng.uniform(20.0, 20.3), rng.uniform(max_lat - 0.5, max_lat)) for _ in range(1000)]
+    points += _edge_points(rng, max_lat, 499)
+    points.append((20.15, max_lat))    # pins the latitude the cells are sized for
+    assert len(points) == 1500
+
+    expected = _brute_force(points, MAX_M)
+    found = _grid(points, MAX_M)
+    assert len(found) == len(find_close_pairs(points, MAX_M))   # no pair reported twice
+    assert len(expected) > 100
+
+    # The grid scales longitude by one endpoint's latitude instead of the
+    # midpoint's; the two may disagree only for pairs right at the threshold
+    for pair in set(expected) ^ set(found):
+        assert abs((expected.get(pair) or found[pair]) - MAX_M) < 0.5, pair
+    for pair in set(expected) & set(found):
+        assert found[pair] == pytest.approx(expected[pair], abs=0.5)
+
+
+def test_small_inputs():
+    assert find_close_pairs([]) == []
+    assert find_close_pairs([(24.9, 60.1)]) == []
+    assert _grid([(24.9, 60.1), (24.9, 60.1)], MAX_M) == {(0, 1): 0.0}
@@ -0,0 +1,42 @@
+"""compute_rollups() counts for single collections and spool replays"""
+
+from rollups import compute_rollups
+
+
+def _row(timestamp, mmsi, territory='FI'):
+    return {'timestamp': timestamp, 'mmsi': mmsi, 'ship_type': 70,
+            'territorial_water_country_code': territory}
+
+
+def _by_key(rollups):
+    return {(r['dimension'], r['key']): (r['positions'], r['collections']) for r in rollups}
+
+
+def test_single_collection_counts_once():
+    rows = [_row('2025-12-05T10:00:00+00:00', m) for m in (230000001, 230000002, 230000003)]
+    counts = _by_key(compute_rollups(rows))
+    assert counts[('total', '')] == (3, 1)
+    assert counts[('flag', '230')] == (3, 1)
+
+
+def test_replay_of_several_collections_counts_each():
+    # Two collections in the same hour uploaded in one spool replay
+    rows = [_row('2025-12-05T10:00:00+00:00', 230000001),
+            _row('2025-12-05T10:00:00+00:00', 230000002, territory=None),
+            _row('2025-12-05T10:30:00+00:00', 230000001),
+            _row('2025-12-05T10:30:00+00:00', 230000002)]
+    counts = _by_key(compute_rollups(rows))
+    assert counts[('total', '')] == (4, 2)
+    assert counts[('territory', 'FI')] == (3, 2)
+    assert counts[('territory', '')] == (1, 1)
+
+
+def test_streamed_rows_use_stream_dimensions():
+    # The collection timestamp comes back from PostgREST in another format
+    rows = [_row('2025-12-05T10:00:00.5+00:00', 230000001),
+            _row('2025-12-05T10:07:12.25+00:00', 230000002),
+            _row('2025-12-05T10:07:22.75+00:00', 230000003)]
+    counts = _by_key(compute_rollups(rows, ['2025-12-05T10:00:00.500000+00:00']))
+    assert counts[('total', '')] == (1, 1)
+    assert counts[('stream_total', '')] == (2, 0)
+    assert counts[('stream_territory', 'FI')] == (2, 0)
@@ -0,0 +1,136 @@
+"""SnapshotStore diffs and the /snapshot ETag handling"""
+
+import asyncio
+import gzip
+import json
+
+import snapshot_server
+from snapshot_server import SnapshotServer, SnapshotStore
+
+BOX = (24.0, 59.0, 26.0, 61.0)
+
+
+def _vessel(mmsi, lon, lat, sog=8.0):
+    return {'mmsi': mmsi, 'lon': lon, 'lat': lat, 'sog': sog}
+
+
+def _snapshot(*vessels, **extra):
+    return {'timestamp': '2025-12-06T05:00:00+00:00', 'vessels': list(vessels), **extra}
+
+
+def test_publish_counts_entered_moved_left():
+    store = SnapshotStore()
+    assert store.publish(_snapshot(_vessel(1, 25.0, 60.0), _vessel(2, 25.1, 60.1))) == (2, 0, 0)
+    assert store.publish(_snapshot(_vessel(1, 25.0, 60.0), _vessel(2, 25.2, 60.1),
+                                   _vessel(3, 25.3, 60.3))) == (1, 1, 0)
+    assert store.publish(_snapshot(_vessel(2, 25.2, 60.1), _vessel(3, 25.3, 60.3))) == (0, 0, 1)
+    assert store.version == 3
+
+
+def test_since_body_lists_entered_moved_and_left():
+    store = SnapshotStore()
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0), _vessel(2, 25.1, 60.1), _vessel(3, 25.2, 60.2)))
+    since = store.version
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0),          # unchanged
+                            _vessel(2, 25.15, 60.1),         # moved
+                            _vessel(4, 25.4, 60.4)))         # entered; 3 left
+
+    body = json.loads(store.since_body(since))
+    assert body['full'] is False
+    assert sorted(v['mmsi'] for v in body['vessels']) == [2, 4]
+    assert body['left'] == [3]
+    assert json.loads(store.since_body(store.version))['vessels'] == []
+
+
+def test_since_body_reports_bbox_exit_as_left():
+    store = SnapshotStore()
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0), _vessel(2, 25.1, 60.1)))
+    since = store.version
+    store.publish(_snapshot(_vessel(1, 27.0, 60.0),          # moved out of the box
+                            _vessel(2, 25.2, 60.1)))
+
+    body = json.loads(store.since_body(since, BOX))
+    assert [v['mmsi'] for v in body['vessels']] == [2]
+    assert body['left'] == [1]
+
+
+def test_history_floor():
+    store = SnapshotStore()
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0), _vessel(2, 25.1, 60.1)))
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0)))         # 2 leaves at version 2
+    assert store.removed == {2: 2}
+
+    for i in range(snapshot_server.HISTORY_VERSIONS):
+        store.publish(_snapshot(_vessel(1, 25.0 + i / 1000, 60.0)))
+
+    assert store.can_diff_from(store.version - snapshot_server.HISTORY_VERSIONS)
+    assert not store.can_diff_from(store.version - snapshot_server.HISTORY_VERSIONS - 1)
+    assert not store.can_diff_from(store.version + 1)
+    # The departure is older than any version still diffable
+    assert store.removed == {}
+
+
+def test_extra_keys_are_kept():
+    store = SnapshotStore()
+    encounters = [{'mmsi_a': 1, 'mmsi_b': 2, 'distance_m': 80}]
+    store.publish(_snapshot(_vessel(1, 25.0, 60.0), encounters=encounters, encounter_count=1,
+                            vessel_count=99))
+    for body in (store.body, store.snapshot_body(BOX), store.since_body(0)):
+        body = json.loads(body)
+        assert body['encounters'] == encounters
+        assert body['encounter_count'] == 1
+        assert body['vessel_count'] == 1
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _get(server, path, **headers):
+    async def run():
+        reader = asyncio.StreamReader()
+        lines = [f'GET {path} HTTP/1.1'] + [f'{k.replace("_", "-")}: {v}' for k, v in headers.items()]
+        reader.feed_data(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        reader.feed_eof()
+        writer = _Writer()
+        await server.handle(reader, writer)
+        return writer.data
+
+    raw = asyncio.run(run())
+    head, _, body = raw.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    response_headers = dict(line.split(': ', 1) for line in lines[1:])
+    return lines[0].split(' ', 2)[1], response_headers, body
+
+
+def test_etag_differs_per_content_encoding():
+    server = SnapshotServer()
+    server.store.publish(_snapshot(*(_vessel(m, 25.0, 60.0 + m / 1000) for m in range(100))))
+
+    status, plain, body = _get(server, '/snapshot')
+    assert status == '200' and 'Content-Encoding' not in plain
+    status, zipped, zbody = _get(server, '/snapshot', Accept_Encoding='gzip')
+    assert status == '200' and zipped['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zbody) == body
+    assert zipped['ETag'] == plain['ETag'][:-1] + '-gz"'
+
+    # A cached gzip body only revalidates for a gzip request, and vice versa
+    assert _get(server, '/snapshot', Accept_Encoding='gzip', If_None_Match=zipped['ETag'])[0] == '304'
+    assert _get(server, '/snapshot', If_None_Match=zipped['ETag'])[0] == '200'
+    assert _get(server, '/snapshot', Accept_Encoding='gzip', If_None_Match=plain['ETag'])[0] == '200'
+
+    # Filtered responses
+    path = '/snapshot?bbox=24,59,26,61'
+    status, zipped, _ = _get(server, path, Accept_Encoding='gzip')
+    assert zipped['ETag'].endswith('-gz"')
+    assert _get(server, path, Accept_Encoding='gzip', If_None_Match=zipped['ETag'])[0] == '304'
@@ -0,0 +1,102 @@
+"""Replay a small recording through StreamIngest against the fake Supabase client"""
+
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+import collect_ais
+import spool
+import stream_ais
+from fakes import FakeSupabase
+from regions import Region
+
+REPO = Path(__file__).resolve().parent.parent
+T = 1765000000
+
+
+def _location(mmsi, lon, lat, sog, t):
+    return {'t': t, 'topic': f'vessels-v2/{mmsi}/location',
+            'payload': {'lon': lon, 'lat': lat, 'sog': sog, 'cog': 90.0, 'navStat': 0,
+                        'heading': 90, 'posAcc': True, 'time': t}}
+
+
+MESSAGES = [
+    {'t': T, 'topic': 'vessels-v2/230000001/metadata',
+     'payload': {'name': 'ALPHA ', 'type': 70, 'destination': 'HELSINKI', 'draught': 50}},
+    _location(230000001, 24.90, 60.10, 8.0, T),
+    _location(230000001, 24.90, 60.10, 8.0, T),       # redelivered after a reconnect
+    _location(230000002, 22.00, 59.80, 12.0, T),
+    _location(230000001, 24.91, 60.10, 8.0, T + 10),
+    _location(219000001, 10.00, 55.00, 10.0, T),      # outside the region
+    _location(230000003, 24.95, 60.16, 0.0, T),       # stationary: anchor watch only
+    {'t': T, 'topic': 'vessels-v2/not-a-number/location', 'payload': {}},
+]
+
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    shutil.copy(REPO / 'territorial_waters_baltic.geojson', tmp_path)
+    (tmp_path / 'data' / 'ais').mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'messages.ndjson'
+    path.write_text(''.join(json.dumps(m) + '\n' for m in MESSAGES))
+    return path
+
+
+def _replay(monkeypatch, path, client):
+    monkeypatch.setattr(stream_ais, 'get_supabase_client', lambda: client)
+    monkeypatch.setattr(collect_ais, 'get_supabase_client', lambda: client)
+    ingest = stream_ais.StreamIngest([Region.from_bbox('baltic', stream_ais.BBOX)],
+                                     batch_size=2, aggregate_s=3600)
+    stream_ais.run_replay(ingest, path, 0)
+    # The replay has already stopped the ingest: the writer drains and exits
+    ingest.run_writer()
+    return ingest
+
+
+def _calls(client, name):
+    return [payload for table, payload in client.calls if table == name]
+
+
+def test_replay_uploads_and_folds_once(recording, monkeypatch):
+    client = FakeSupabase()
+    ingest = _replay(monkeypatch, recording, client)
+
+    assert ingest.stats['received'] == 6
+    assert ingest.stats['out_of_region'] == 1
+    rows = [row for batch in _calls(client, 'vessel_positions') for row in batch]
+    assert len({(r['mmsi'], r['report_time']) for r in rows}) == len(rows) == 3
+    assert rows[0]['name'] == 'ALPHA'
+    assert len({r['timestamp'] for r in rows}) == 2    # one per micro-batch
+    assert spool.pending_segments() == []
+    assert (recording.parent / 'data/ais/anchor_state.bin').exists()
+
+    # Micro-batches are not collections
+    assert _calls(client, 'collection_summary') == []
+    rollup_calls = _calls(client, 'apply_vessel_rollups')
+    assert len(rollup_calls) == 1
+    rollups = rollup_calls[0]['rollups']
+    assert all(r['dimension'].startswith('stream_') for r in rollups)
+    # (the two micro-batches may fall in different hours)
+    total = [r for r in rollups if r['dimension'] == 'stream_total']
+    assert sum(r['positions'] for r in total) == 3
+    assert all(r['collections'] == 0 for r in total)
+    assert len(_calls(client, 'merge_mmsi_sketch')) == 1
+
+
+def test_replayed_collector_segment_still_counts_as_collection(recording, monkeypatch):
+    # A collection whose upload failed is waiting in the shared spool
+    stamp = '2025-12-06T05:00:00+00:00'
+    spool.write_segment([{'timestamp': stamp, 'report_time': stamp, 'mmsi': 230000009,
+                          'ship_type': 70, 'territorial_water_country_code': 'FI'}],
+                        {'timestamp': stamp, 'vessel_count': 1, 'collection_time_ms': 10})
+    client = FakeSupabase()
+    _replay(monkeypatch, recording, client)
+
+    assert len(_calls(client, 'collection_summary')) == 1
+    rollups = _calls(client, 'apply_vessel_rollups')[0]['rollups']
+    assert [(r['positions'], r['collections']) for r in rollups
+            if r['dimension'] == 'total'] == [(1, 1)]
+    assert sum(r['positions'] for r in rollups if r['dimension'] == 'stream_total') == 3
@@ -0,0 +1,65 @@
+"""downsample_track() keep rules"""
+
+from datetime import datetime, timedelta, timezone
+
+from track_retention import (KEEP_BOUNDARY, KEEP_ENDPOINT, KEEP_INTERVAL, KEEP_TURN,
+                             cog_delta, downsample_track)
+
+HOUR = 3600
+START = datetime(2025, 12, 5, 0, 0, tzinfo=timezone.utc)
+
+
+def _fix(minutes, cog=90.0, territory='FI'):
+    """A SELECT_SQL row: mmsi, t, lon, lat, sog, cog, heading, nav_stat, ship_type, territory"""
+    return (230000001, START + timedelta(minutes=minutes), 24.9, 60.1, 8.0, cog,
+            90, 0, 70, territory)
+
+
+def _kept(fixes, interval_s=6 * HOUR, turn_deg=30.0):
+    """{minutes: reason} of the kept fixes"""
+    return {int((row[1] - START).total_seconds() // 60): reason
+            for row, reason in downsample_track(fixes, interval_s, turn_deg)}
+
+
+def test_endpoints_are_kept():
+    kept = _kept([_fix(m) for m in range(0, 300, 60)])
+    assert kept == {0: KEEP_ENDPOINT | KEEP_INTERVAL, 240: KEEP_ENDPOINT}
+    assert _kept([_fix(30)]) == {30: KEEP_ENDPOINT | KEEP_INTERVAL}
+
+
+def test_interval_buckets():
+    # Hourly fixes over 13 hours, 6 h buckets aligned to the epoch
+    kept = _kept([_fix(m) for m in range(0, 13 * 60, 60)])
+    assert kept == {0: KEEP_ENDPOINT | KEEP_INTERVAL,
+                    360: KEEP_INTERVAL,
+                    720: KEEP_ENDPOINT | KEEP_INTERVAL}
+
+
+def test_boundary_crossing_keeps_both_sides():
+    fixes = [_fix(m, territory='FI') for m in (0, 60, 120)]
+    fixes += [_fix(m, territory=None) for m in (180, 240)]
+    fixes += [_fix(m, territory='EE') for m in (300, 330)]
+    kept = _kept(fixes)
+    assert kept[120] == KEEP_BOUNDARY
+    assert kept[180] == KEEP_BOUNDARY
+    assert kept[240] == KEEP_BOUNDARY
+    assert kept[300] == KEEP_BOUNDARY
+    assert 60 not in kept
+
+
+def test_turn_threshold():
+    fixes = [_fix(0, cog=90.0),
+             _fix(60, cog=119.0),      # 29 degrees from the last kept fix: dropped
+             _fix(120, cog=120.0),     # 30 degrees: kept as a turn
+             _fix(180, cog=140.0),     # 20 from the new reference: dropped
+             _fix(240, cog=None),      # no course: never a turn
+             _fix(300, cog=130.0)]     # endpoint
+    kept = _kept(fixes)
+    assert kept == {0: KEEP_ENDPOINT | KEEP_INTERVAL, 120: KEEP_TURN, 300: KEEP_ENDPOINT}
+
+
+def test_turn_across_north():
+    assert cog_delta(350.0, 10.0) == 20.0
+    kept = _kept([_fix(0, cog=350.0), _fix(60, cog=15.0), _fix(120, cog=25.0), _fix(180)])
+    assert 60 not in kept
+    assert kept[120] == KEEP_TURN